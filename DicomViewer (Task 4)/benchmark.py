@@ -0,0 +1,455 @@
+"""Headless benchmarks for the DICOM viewer's loading, normalization, paging, cine and anonymization paths.
+
+Synthetic series are generated into a temporary folder, so runs are repeatable on any machine:
+
+    python benchmark.py --slices 200 --matrix 512 --bits 12
+    python benchmark.py --multiframe --compressed --json after.json --compare before.json
+    python benchmark.py --check
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import nullcontext
+
+try:
+    import resource  # Unix only: resident memory of this process and its worker processes
+except ImportError:
+    resource = None
+
+# The viewer widgets are driven without a display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, RLELossless, generate_uid
+from PyQt5.QtWidgets import QApplication
+
+from main import (DICOMViewer, DicomIngestServer, EncapsulatedFrames, SignExtendedFrames, anonymize_dataset,
+                  anonymize_tree, apply_window, auto_window, memory_map_frames, open_encapsulated_frames,
+                  save_dataset, scan_dicom_tree, send_dicom_files, window_lut)
+
+CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+ENHANCED_CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2.1'
+
+
+def phantom_slices(slices, matrix, bits, seed=0):
+    """Yield (matrix, matrix) slices of a noisy disc phantom whose contrast changes along the series"""
+    rng = np.random.default_rng(seed)
+    max_value = 2 ** bits - 1
+    y, x = np.ogrid[:matrix, :matrix]
+    radius = np.hypot(x - matrix / 2.0, y - matrix / 2.0) / (matrix / 2.0)
+    dtype = np.uint8 if bits <= 8 else np.uint16
+    for index in range(slices):
+        level = 0.3 + 0.4 * index / max(slices - 1, 1)
+        image = np.where(radius < 0.8, level, 0.05) * max_value
+        image = image + rng.normal(0.0, 0.02 * max_value, image.shape)
+        yield np.clip(image, 0, max_value).astype(dtype)
+
+
+def synthetic_dataset(pixels, bits, study_uid, series_uid, instance_number, compressed):
+    """CT dataset holding one slice (rows, cols) or a frame stack (frames, rows, cols)"""
+    multiframe = pixels.ndim == 3
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = ENHANCED_CT_IMAGE_STORAGE if multiframe else CT_IMAGE_STORAGE
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.PatientName = 'Benchmark^Phantom'
+    ds.PatientID = 'BENCH0001'
+    ds.PatientBirthDate = '19700101'
+    ds.StudyDate = '20250101'
+    ds.InstitutionName = 'Synthetic'
+    ds.Modality = 'CT'
+    ds.SeriesNumber = 1
+    ds.SeriesDescription = 'Synthetic phantom'
+    ds.InstanceNumber = instance_number
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.ImagePositionPatient = [0.0, 0.0, float(instance_number)]
+    ds.PixelSpacing = [0.5, 0.5]
+    ds.SliceThickness = 1.0
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.Rows, ds.Columns = pixels.shape[-2:]
+    ds.BitsAllocated = pixels.dtype.itemsize * 8
+    ds.BitsStored = bits
+    ds.HighBit = bits - 1
+    ds.PixelRepresentation = 0
+    ds.RescaleSlope = 1
+    ds.RescaleIntercept = -1024 if bits > 8 else 0
+    if multiframe:
+        ds.NumberOfFrames = pixels.shape[0]
+        ds.FrameTime = 40.0
+    ds.PixelData = pixels.tobytes()
+    if compressed:
+        ds.compress(RLELossless, pixels)
+    return ds
+
+
+def generate_series(output_dir, slices=64, matrix=512, bits=16, multiframe=False, compressed=False, seed=0):
+    """Write a synthetic CT series to output_dir and return the written file paths"""
+    os.makedirs(output_dir, exist_ok=True)
+    study_uid, series_uid = generate_uid(), generate_uid()
+    frames = phantom_slices(slices, matrix, bits, seed)
+    if multiframe:
+        file_path = os.path.join(output_dir, 'multiframe.dcm')
+        save_dataset(synthetic_dataset(np.stack(list(frames)), bits, study_uid, series_uid, 1, compressed),
+                     file_path)
+        return [file_path]
+
+    file_paths = []
+    for index, pixels in enumerate(frames):
+        file_path = os.path.join(output_dir, f'slice_{index:05d}.dcm')
+        save_dataset(synthetic_dataset(pixels, bits, study_uid, series_uid, index + 1, compressed), file_path)
+        file_paths.append(file_path)
+    return file_paths
+
+
+def max_rss_mb(children=False):
+    """Peak resident memory of this process, or of its largest finished child process; None off Unix"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage.ru_maxrss / (1e6 if sys.platform == 'darwin' else 1e3)
+
+
+def measure(name, run, units):
+    """Time run(), which returns the number of units it processed, and record its peak memory
+
+    tracemalloc only sees Python allocations in this process. Stages that run on a process pool
+    also report the resident peak of the largest worker, once the pool has shut down.
+    """
+    workers_before = max_rss_mb(children=True)
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    count = run()
+    elapsed = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    workers_after = max_rss_mb(children=True)
+    worker_peak = workers_after if workers_after and workers_after != workers_before else None
+    result = {'name': name, 'count': count, 'units': units, 'seconds': elapsed,
+              'throughput': count / elapsed if elapsed > 0 else float('inf'), 'peak_mb': peak / 1e6,
+              'worker_rss_mb': worker_peak}
+    workers = f"{worker_peak:9.1f} MB worker RSS" if worker_peak else ''
+    print(f"{name:<22} {count:>7} {units:<7} {elapsed:8.3f} s {result['throughput']:10.1f} {units}/s "
+          f"{result['peak_mb']:9.1f} MB parent peak {workers}")
+    return result
+
+
+def run_benchmarks(data_dir, work_dir, multiframe, compressed=False, workers=None):
+    """Run every stage and return (results, frame path), where frame path names the frame access that ran"""
+    app = QApplication.instance() or QApplication([])
+    viewer = DICOMViewer()
+    viewer.catalog = None  # Measure parsing, not catalog reuse
+    results = []
+    state = {}
+
+    def scan_headers():
+        state['records'] = scan_dicom_tree(data_dir, workers)
+        return len(state['records'])
+    results.append(measure('load: header scan', scan_headers, 'files'))
+
+    def decode_slices():
+        state['slices'] = [record.read_image() for record in state['records']]
+        return len(state['slices'])
+    if not multiframe:
+        results.append(measure('load: decode', decode_slices, 'slices'))
+
+    if multiframe:
+        viewer.dicom_data = pydicom.dcmread(state['records'][0].file_path, defer_size='4 MB')
+        viewer.display_image()
+    else:
+        viewer.series_index.add(state['records'])
+        viewer.current_series = viewer.series_index.series_keys()[0]
+        viewer.dicom_files = viewer.series_index.series(*viewer.current_series)
+        viewer.open_series_volume()
+    volume = viewer.image_data_3d
+    transform = viewer.volume_transform
+    frame_path = type(volume).__name__
+    print(f"Frame access: {frame_path}")
+    window = auto_window([volume[0]], transform)
+
+    # Memory-mapped and per-frame decoded volumes read or decode a frame on each access, so load
+    # every frame once as its own stage and let both normalize stages time only the normalization
+    frames = volume
+    if type(volume) is not np.ndarray:
+        def read_frames():
+            state['frames'] = [volume[index] for index in range(volume.shape[0])]
+            return len(state['frames'])
+        results.append(measure('load: frames', read_frames, 'frames'))
+        frames = state['frames']
+
+    def normalize_lut():
+        window_lut.cache_clear()
+        for frame in frames:
+            apply_window(frame, transform, window)
+        return len(frames)
+    results.append(measure('normalize: LUT', normalize_lut, 'slices'))
+
+    def normalize_minmax():
+        # The per-slice float min/max scaling the viewer used before window LUTs
+        for frame in frames:
+            pixels = frame.astype(np.float32)
+            low, high = pixels.min(), pixels.max()
+            ((pixels - low) / max(high - low, 1.0) * 255.0).astype(np.uint8)
+        return len(frames)
+    results.append(measure('normalize: min/max', normalize_minmax, 'slices'))
+    state.pop('frames', None)
+    frames = None  # Release the loaded frames before paging decodes them again
+
+    def page_through(cold):
+        def run():
+            if cold:
+                viewer.slice_cache.clear()
+                viewer.pixmap_cache.clear()
+            pages = 0
+            for start in range(0, max(volume.shape[0] - viewer.slices_per_grid, 0) + 1):
+                viewer.update_displayed_grid(start)
+                app.processEvents()
+                pages += 1
+            return pages
+        return run
+    results.append(measure('paging: cold', page_through(True), 'pages'))
+    results.append(measure('paging: cached', page_through(False), 'pages'))
+
+    def build_cine():
+        viewer.display_window = window
+        viewer.play_video()
+        viewer.stop_video()
+        return volume.shape[0]
+    results.append(measure('cine: prepare', build_cine, 'frames'))
+
+    def play_cine():
+        # Render every frame back to back to find the frame rate the display path can sustain
+        for frame_index in range(viewer.cine_frame_count):
+            viewer.show_cine_frame(frame_index)
+            app.processEvents()
+        return viewer.cine_frame_count
+    results.append(measure('cine: playback', play_cine, 'frames'))
+    viewer.clear_all_data()
+
+    def anonymize():
+        output_dir = os.path.join(work_dir, 'anonymized')
+        shutil.rmtree(output_dir, ignore_errors=True)
+        counts = anonymize_tree(data_dir, output_dir, 'BENCH', 'benchmark', workers)
+        return counts['ok']
+    results.append(measure('anonymize', anonymize, 'files'))
+    return results, frame_path
+
+
+def check(name, passed, detail=''):
+    print(f"{'ok' if passed else 'FAIL':<5} {name}{': ' + detail if detail else ''}")
+    return passed
+
+
+def check_frame_access(work_dir):
+    """Frame access paths against pydicom's pixel_array, with files above the viewer's defer size"""
+    failures = 0
+    uids = (generate_uid(), generate_uid())
+
+    # 24 x 512 x 512 x 16 bit is about 12 MB, so PixelData stays deferred at 4 MB
+    frames = np.stack(list(phantom_slices(24, 512, 12)))
+    file_path = os.path.join(work_dir, 'large_multiframe.dcm')
+    save_dataset(synthetic_dataset(frames, 12, *uids, 1, False), file_path)
+    dicom_data = pydicom.dcmread(file_path, defer_size='4 MB')
+    mapped = memory_map_frames(file_path, dicom_data)
+    failures += not check('mmap: deferred PixelData', isinstance(mapped, np.memmap),
+                          f"got {type(mapped).__name__}")
+    failures += not check('mmap: values', mapped is not None and
+                          np.array_equal(mapped, pydicom.dcmread(file_path).pixel_array))
+
+    # Signed 12-bit values in 16-bit words, with the unused high bits left clear
+    values = np.array([-5, -2000, 0, 2047, -2048, 100], dtype=np.int16)
+    signed_frames = np.resize(values, (24, 512, 512)).astype(np.int16)
+    ds = synthetic_dataset(signed_frames.view(np.uint16) & 0x0FFF, 12, *uids, 2, False)
+    ds.PixelRepresentation = 1
+    file_path = os.path.join(work_dir, 'signed_multiframe.dcm')
+    save_dataset(ds, file_path)
+    mapped = memory_map_frames(file_path, pydicom.dcmread(file_path, defer_size='4 MB'))
+    failures += not check('mmap: signed 12-in-16', isinstance(mapped, SignExtendedFrames) and
+                          all(np.array_equal(mapped[index], signed_frames[index]) for index in (0, 23)))
+
+    # Color frames keep their samples axis, so the viewer still plays them as cine
+    ds = synthetic_dataset(frames[:10, :32, :48].astype(np.uint8), 8, *uids, 3, False)
+    ds.SamplesPerPixel = 3
+    ds.PhotometricInterpretation = 'RGB'
+    ds.PlanarConfiguration = 0
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 8, 8, 7
+    ds.PixelData = np.repeat(frames[:10, :32, :48, None].astype(np.uint8), 3, axis=3).tobytes()
+    file_path = os.path.join(work_dir, 'color_multiframe.dcm')
+    save_dataset(ds, file_path)
+    mapped = memory_map_frames(file_path)
+    failures += not check('mmap: color frames', mapped is not None and mapped.shape == (10, 32, 48, 3) and
+                          np.array_equal(mapped, pydicom.dcmread(file_path).pixel_array),
+                          f"shape {None if mapped is None else mapped.shape}")
+
+    # Noisy 16-bit frames compress poorly, so the RLE PixelData is well above the defer size too
+    file_path = os.path.join(work_dir, 'large_rle_multiframe.dcm')
+    save_dataset(synthetic_dataset(frames, 12, *uids, 4, True), file_path)
+    dicom_data = pydicom.dcmread(file_path, defer_size='4 MB')
+    encapsulated = open_encapsulated_frames(file_path, dicom_data)
+    failures += not check('per-frame decode: deferred RLE', isinstance(encapsulated, EncapsulatedFrames),
+                          f"got {type(encapsulated).__name__}, {os.path.getsize(file_path) / 1e6:.1f} MB file")
+    if encapsulated is not None:
+        decoded = pydicom.dcmread(file_path).pixel_array
+        failures += not check('per-frame decode: values',
+                              all(np.array_equal(encapsulated[index], decoded[index]) for index in (0, 23)))
+        encapsulated.close()
+    return failures
+
+
+def check_anonymization(work_dir):
+    """Identifiers nested in sequence items are replaced like top-level ones"""
+    failures = 0
+    ds = synthetic_dataset(np.zeros((8, 8), dtype=np.uint16), 12, generate_uid(), generate_uid(), 1, False)
+    referenced_patient = Dataset()
+    referenced_patient.PatientName = ds.PatientName
+    referenced_patient.PatientID = ds.PatientID
+    request = Dataset()
+    request.AccessionNumber = 'ACC0001'
+    request.ScheduledProcedureStepSequence = [Dataset()]
+    request.ScheduledProcedureStepSequence[0].ScheduledPerformingPhysicianName = 'Doctor^Nested'
+    ds.ReferencedPatientSequence = [referenced_patient]
+    ds.RequestAttributesSequence = [request]
+    file_path = os.path.join(work_dir, 'nested_identifiers.dcm')
+    save_dataset(anonymize_dataset(ds, 'ANON', 'check-secret'), file_path)
+
+    with open(file_path, 'rb') as dicom_file:
+        contents = dicom_file.read()
+    leaked = [value for value in ('Benchmark^Phantom', 'BENCH0001', 'ACC0001', 'Doctor^Nested')
+              if value.encode() in contents]
+    failures += not check('anonymize: nested identifiers', not leaked, f"left {', '.join(leaked)}" if leaked else '')
+    failures += not check('anonymize: nested pseudonyms match',
+                          ds.ReferencedPatientSequence[0].PatientName == ds.PatientName and
+                          ds.ReferencedPatientSequence[0].PatientID == ds.PatientID)
+    try:
+        anonymize_dataset(ds, 'ANON', '')
+        failures += not check('anonymize: secret required', False, "an empty secret was accepted")
+    except ValueError:
+        check('anonymize: secret required', True)
+    return failures
+
+
+def check_ingest(work_dir):
+    """Received instances whose UIDs would lead out of the storage folder are rejected"""
+    failures = 0
+    storage_dir = os.path.join(work_dir, 'ingest', 'incoming')
+    server = DicomIngestServer(storage_dir=storage_dir, http_port=0, dimse_port=0,
+                               catalog_path=os.path.join(work_dir, 'ingest', 'catalog.sqlite3'))
+    server.start()
+    url = f'http://127.0.0.1:{server.http_server.server_address[1]}/studies'
+    try:
+        # ".." matches the UID pattern, so the second case is caught by the real-path check
+        for name, study_uid, series_uid in (('traversal UID', '../../escape', generate_uid()),
+                                            ('dot-only UIDs', '..', '..')):
+            send_dir = os.path.join(work_dir, 'ingest', name.replace(' ', '_'))
+            os.makedirs(send_dir, exist_ok=True)
+            ds = synthetic_dataset(np.zeros((8, 8), dtype=np.uint16), 12, generate_uid(), generate_uid(), 1, False)
+            # Newer pydicom refuses to set a malformed UID unless validation is off
+            with getattr(pydicom.config, 'disable_value_validation', nullcontext)():
+                ds.StudyInstanceUID, ds.SeriesInstanceUID = study_uid, series_uid
+                save_dataset(ds, os.path.join(send_dir, 'hostile.dcm'))
+            rejected = not send_dicom_files(send_dir, url)
+            target = os.path.join(storage_dir, study_uid, series_uid, str(ds.SOPInstanceUID) + '.dcm')
+            failures += not check(f'ingest: {name} rejected', rejected and not os.path.exists(target) and
+                                  not os.path.exists(target + '.partial'))
+
+        send_dir = os.path.join(work_dir, 'ingest', 'valid')
+        file_path = generate_series(send_dir, slices=1, matrix=8, bits=12)[0]
+        header = pydicom.dcmread(file_path)
+        failures += not check('ingest: valid instance stored', send_dicom_files(send_dir, url) and os.path.exists(
+            os.path.join(storage_dir, header.StudyInstanceUID, header.SeriesInstanceUID,
+                         header.SOPInstanceUID + '.dcm')))
+    finally:
+        server.stop()
+    return failures
+
+
+def run_checks(work_dir):
+    """Correctness checks for the fast paths; returns the number of failures"""
+    failures = check_frame_access(work_dir) + check_anonymization(work_dir) + check_ingest(work_dir)
+    print(f"\n{failures} check(s) failed" if failures else "\nAll checks passed")
+    return failures
+
+
+def compare_results(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = {result['name']: result for result in json.load(baseline_file)['results']}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        before = baseline.get(result['name'])
+        if before and before['throughput'] > 0:
+            change = result['throughput'] / before['throughput']
+            print(f"{result['name']:<22} {change:6.2f}x throughput, "
+                  f"{result['peak_mb'] - before['peak_mb']:+8.1f} MB peak")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DICOM viewer on a synthetic series")
+    parser.add_argument('--slices', type=int, default=64)
+    parser.add_argument('--matrix', type=int, default=512)
+    parser.add_argument('--bits', type=int, default=12, help="Bits stored per pixel (8 to 16)")
+    parser.add_argument('--multiframe', action='store_true', help="Write one multi-frame file instead of slices")
+    parser.add_argument('--compressed', action='store_true', help="RLE Lossless instead of uncompressed")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--data-dir', help="Reuse or keep the generated series in this folder")
+    parser.add_argument('--json', help="Write the results to this file")
+    parser.add_argument('--compare', help="Results file from an earlier run to compare against")
+    parser.add_argument('--check', action='store_true', help="Check the fast paths against pydicom and exit")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='dicom_benchmark_')
+    if args.check:
+        try:
+            return 1 if run_checks(work_dir) else 0
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    try:
+        data_dir = args.data_dir or os.path.join(work_dir, 'series')
+        if not os.path.isdir(data_dir) or not os.listdir(data_dir):
+            start_time = time.perf_counter()
+            generate_series(data_dir, args.slices, args.matrix, args.bits, args.multiframe, args.compressed)
+            print(f"Generated {args.slices} x {args.matrix}x{args.matrix} {args.bits}-bit slices "
+                  f"({'multi-frame' if args.multiframe else 'single-frame'}, "
+                  f"{'RLE' if args.compressed else 'uncompressed'}) in {time.perf_counter() - start_time:.1f} s\n")
+        results, frame_path = run_benchmarks(data_dir, work_dir, args.multiframe, args.compressed, args.workers)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    max_rss = max_rss_mb()
+    worker_rss = max_rss_mb(children=True)
+    if max_rss is None:
+        print("\nPeak resident memory: not available on this platform")
+    else:
+        print(f"\nPeak resident memory: {max_rss:.0f} MB, largest worker process {worker_rss:.0f} MB")
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump({'config': vars(args), 'peak_rss_mb': max_rss, 'worker_rss_mb': worker_rss,
+                       'frame_path': frame_path, 'results': results}, results_file, indent=2)
+    if args.compare:
+        compare_results(results, args.compare)
+
+    # A multi-frame series must take the lazy frame path, or the timings measure a full decode
+    if args.multiframe:
+        expected = (EncapsulatedFrames,) if args.compressed else (np.memmap, SignExtendedFrames)
+        if frame_path not in [frame_type.__name__ for frame_type in expected]:
+            print(f"Expected {' or '.join(t.__name__ for t in expected)} frame access, got {frame_path}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
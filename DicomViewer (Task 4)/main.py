@@ -1,15 +1,1404 @@
+import io
 import os
+import sys
+import re
+import json
+import hmac
+import time
+import bisect
+import struct
+import socket
+import secrets
+import hashlib
+import sqlite3
+import argparse
+import multiprocessing
+import http.client
 import pydicom
-import random
-import string
+import threading
 import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from pydicom.uid import generate_uid
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.dataelem import RawDataElement
+from pydicom.encaps import encapsulate
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QLabel, QTextEdit, \
-    QFileDialog, QGridLayout, QSlider
+    QFileDialog, QGridLayout, QSlider, QProgressBar, QComboBox, QSpinBox, QCheckBox
 from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QObject, QTimer, QThread, QElapsedTimer, pyqtSignal
+
+try:
+    from pydicom.pixels import apply_modality_lut, apply_voi_lut  # pydicom >= 3
+except ImportError:
+    from pydicom.pixel_data_handlers.util import apply_modality_lut, apply_voi_lut
+
+try:
+    from pynetdicom import AE, evt, StoragePresentationContexts  # Optional: C-STORE receiver
+except ImportError:
+    AE = None
+
+# Common CT windows as (center, width) in Hounsfield units
+CT_WINDOW_PRESETS = {
+    "Brain": (40, 80),
+    "Subdural": (75, 215),
+    "Stroke": (32, 8),
+    "Lung": (-600, 1500),
+    "Mediastinum": (50, 350),
+    "Abdomen": (40, 400),
+    "Liver": (60, 160),
+    "Bone": (400, 1800),
+}
+VOI_LUT_WINDOW = 'VOI LUT'
+# Cine loops larger than this (as display-sized frames) are rendered on demand instead of up front
+CINE_BUFFER_BYTES = 512 * 1024 * 1024
+# Transfer syntaxes whose PixelData is stored as raw, uncompressed values
+UNCOMPRESSED_TRANSFER_SYNTAXES = {
+    '1.2.840.10008.1.2': '<',  # Implicit VR Little Endian
+    '1.2.840.10008.1.2.1': '<',  # Explicit VR Little Endian
+    '1.2.840.10008.1.2.2': '>',  # Explicit VR Big Endian
+}
+# Tags replaced by a deterministic pseudonym, so linked studies keep matching IDs
+PSEUDONYM_TAGS = ['PatientName', 'PatientID', 'AccessionNumber']
+# Identifying tags that are blanked
+BLANKED_TAGS = ['PatientBirthDate', 'PatientBirthTime', 'PatientAddress', 'PatientTelephoneNumbers',
+                'OtherPatientIDs', 'OtherPatientNames', 'PatientMotherBirthName', 'ReferringPhysicianName',
+                'PerformingPhysicianName', 'PhysiciansOfRecord', 'NameOfPhysiciansReadingStudy',
+                'OperatorsName', 'InstitutionName', 'InstitutionAddress', 'StationName']
+# UIDs remapped consistently so series and studies still group after anonymization
+REMAPPED_UIDS = ['StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'FrameOfReferenceUID']
+ANONYMIZATION_MANIFEST = 'anonymization_manifest.jsonl'
+PYDICOM_MAJOR_VERSION = int(pydicom.__version__.split('.')[0])
+# Where instances received over DICOMweb or C-STORE are written
+INGEST_DIR = os.environ.get('DICOM_INGEST_DIR') or os.path.join(os.path.expanduser('~'), '.dicom_viewer', 'incoming')
+# Received UIDs become path components, so only plain dotted-digit UIDs are accepted
+DICOM_UID_PATTERN = re.compile(r'[0-9.]{1,64}')
+# STOW-RS FailureReason for instances that are rejected (PS3.18 "cannot understand")
+STOW_CANNOT_UNDERSTAND = 0xC000
+
+
+class PerfStats:
+    """Timings and counters for the load/decode/render stages, with an optional JSON-lines log
+
+    Set DICOM_VIEWER_PERF_LOG (or pass --perf-log) to append one JSON object per timed stage,
+    tagged with the host name and process id so logs from several workstations can be merged.
+    """
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.stages = {}  # stage -> [count, total ms, last ms]
+        self.host = socket.gethostname()
+        self._log_file = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, timings=None, **fields):
+        """Time a block; with a timings list, (name, ms) is also appended to it for another process"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start_time) * 1000.0
+            self.record(name, elapsed_ms, **fields)
+            if timings is not None:
+                timings.append((name, elapsed_ms))
+
+    def _add(self, name, elapsed_ms):
+        totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed_ms
+        totals[2] = elapsed_ms
+
+    def merge(self, timings):
+        """Add (stage, ms) timings measured in a worker process; the worker has already logged them"""
+        with self._lock:
+            for name, elapsed_ms in timings:
+                self._add(name, elapsed_ms)
+
+    def record(self, name, elapsed_ms, **fields):
+        with self._lock:
+            self._add(name, elapsed_ms)
+            if self.log_path:
+                if self._log_file is None:
+                    self._log_file = open(self.log_path, 'a', buffering=1)
+                entry = {'time': time.time(), 'host': self.host, 'pid': os.getpid(), 'stage': name,
+                         'ms': round(elapsed_ms, 3)}
+                entry.update(fields)
+                self._log_file.write(json.dumps(entry) + '\n')
+
+    def summary(self):
+        """(stage, count, average ms, last ms) for every stage seen so far"""
+        with self._lock:
+            return [(name, count, total / count, last) for name, (count, total, last) in sorted(self.stages.items())]
+
+
+PERF = PerfStats(os.environ.get('DICOM_VIEWER_PERF_LOG'))
+
+
+def process_pool(max_workers=None):
+    """ProcessPoolExecutor whose workers do not fork this process
+
+    Pools are started from worker threads while others may hold a lock (PERF's, logging's), and a
+    forked child inherits that lock held forever. forkserver and spawn start clean interpreters.
+    """
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+
+
 # Anonymization Function
-def anonymize_tag(tag_value, prefix):
-    return prefix + ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+def anonymize_tag(tag_value, prefix, secret):
+    """Deterministic pseudonym: the same value and secret always give the same ID"""
+    digest = hmac.new(secret.encode(), str(tag_value).encode(), hashlib.sha256).hexdigest()
+    return prefix + digest[:10].upper()
+
+
+def is_deferred(dataset, tag):
+    """True when an element's value is still on disk (read with defer_size)"""
+    try:
+        element = dataset.get_item(tag, keep_deferred=True)
+    except TypeError:  # pydicom < 2.4 has no keep_deferred
+        return False
+    return isinstance(element, RawDataElement) and element.value is None and element.length > 0
+
+
+def anonymize_elements(dataset, prefix, secret):
+    """De-identify one dataset level, then every item of its sequences"""
+    for keyword in PSEUDONYM_TAGS:
+        if keyword in dataset:
+            dataset.data_element(keyword).value = anonymize_tag(dataset.data_element(keyword).value, prefix, secret)
+    for keyword in BLANKED_TAGS:
+        if keyword in dataset:
+            dataset.data_element(keyword).value = ''
+    for keyword in REMAPPED_UIDS:
+        if keyword in dataset:
+            original_uid = str(dataset.data_element(keyword).value)
+            dataset.data_element(keyword).value = generate_uid(entropy_srcs=[secret, original_uid])
+    for tag in list(dataset.keys()):
+        if tag.is_private:
+            del dataset[tag]
+            continue
+        if is_deferred(dataset, tag):
+            continue  # Large values such as PixelData are neither names nor sequences worth loading
+        element = dataset[tag]
+        if element.VR == 'SQ':
+            for item in element.value:
+                anonymize_elements(item, prefix, secret)
+        elif element.VR == 'PN' and element.keyword not in PSEUDONYM_TAGS:
+            element.value = ''  # Any other person name, wherever it is nested
+
+
+def anonymize_dataset(dicom_data, prefix, secret):
+    """De-identify a dataset in place, including sequence items, without touching its pixel data
+
+    The secret keys the pseudonyms; without one they could be recomputed from candidate IDs.
+    """
+    if not secret:
+        raise ValueError("A secret key is required for pseudonyms")
+    anonymize_elements(dicom_data, prefix, secret)
+    if 'SOPInstanceUID' in dicom_data and hasattr(dicom_data, 'file_meta'):
+        dicom_data.file_meta.MediaStorageSOPInstanceUID = dicom_data.SOPInstanceUID
+    dicom_data.PatientIdentityRemoved = 'YES'
+    return dicom_data
+
+
+def anonymize_files(jobs, prefix, secret):
+    """Worker task: anonymize (source, destination, relative path) jobs and report each result"""
+    results = []
+    for source_path, output_path, relative_path in jobs:
+        try:
+            # Large elements such as PixelData stay deferred and are copied straight from the source on save
+            dicom_data = pydicom.dcmread(source_path, defer_size='1 MB')
+            anonymize_dataset(dicom_data, prefix, secret)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            temporary_path = output_path + '.partial'
+            dicom_data.save_as(temporary_path)
+            os.replace(temporary_path, output_path)
+            results.append({'source': relative_path, 'status': 'ok'})
+        except Exception as e:
+            results.append({'source': relative_path, 'status': 'error', 'error': str(e)})
+    return results
+
+
+def iter_dicom_files(root_path):
+    """Yield DICOM file paths under root_path relative to it, in a stable order"""
+    for directory, subdirectories, filenames in os.walk(root_path):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith('.dcm'):
+                yield os.path.relpath(os.path.join(directory, filename), root_path)
+
+
+def anonymize_tree(input_root, output_root, prefix, secret, max_workers=None, chunk_size=32):
+    """Anonymize a directory tree into a mirrored output tree, resuming from the manifest"""
+    if not secret:
+        raise ValueError("A secret key is required for pseudonyms")
+    os.makedirs(output_root, exist_ok=True)
+    manifest_path = os.path.join(output_root, ANONYMIZATION_MANIFEST)
+    completed = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Partial line from an interrupted run
+                if entry.get('status') == 'ok':
+                    completed.add(entry['source'])
+
+    def job_chunks():
+        chunk = []
+        for relative_path in iter_dicom_files(input_root):
+            if relative_path in completed:
+                continue
+            chunk.append((os.path.join(input_root, relative_path),
+                          os.path.join(output_root, relative_path), relative_path))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    max_workers = max_workers or os.cpu_count() or 1
+    counts = {'ok': 0, 'error': 0, 'skipped': len(completed)}
+    start_time = time.perf_counter()
+    with process_pool(max_workers) as pool, open(manifest_path, 'a') as manifest:
+        # Keep a bounded number of chunks in flight so huge archives do not queue every path at once
+        chunks = job_chunks()
+        pending = set()
+        while True:
+            while len(pending) < max_workers * 2:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.add(pool.submit(anonymize_files, chunk, prefix, secret))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for entry in future.result():
+                    counts[entry['status']] += 1
+                    manifest.write(json.dumps(entry) + '\n')
+                    if entry['status'] == 'error':
+                        print(f"Error anonymizing {entry['source']}: {entry['error']}")
+            manifest.flush()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Anonymized {counts['ok']} files ({counts['error']} errors, {counts['skipped']} already done) "
+          f"in {elapsed:.1f} s")
+    return counts
+
+
+def extract_display_slice(image_data):
+    """Reduce a decoded pixel array to a single 2D grayscale slice"""
+    if len(image_data.shape) == 4:  # Multi-frame color
+        return image_data[0, :, :, 0]
+    if len(image_data.shape) == 3:
+        if image_data.shape[2] <= 4:  # Single-frame color
+            return image_data[:, :, 0]
+        return image_data[0]  # Multi-frame grayscale
+    return image_data
+
+
+def first_value(value):
+    """First item of a multi-valued DICOM element, or the value itself"""
+    if value is not None and not isinstance(value, (str, bytes)) and hasattr(value, '__len__'):
+        return value[0] if len(value) else None
+    return value
+
+
+def pixel_transform(header):
+    """Rescale slope and intercept plus a MONOCHROME1 inversion flag from a DICOM header"""
+    slope = float(first_value(header.get('RescaleSlope')) or 1.0)
+    intercept = float(first_value(header.get('RescaleIntercept')) or 0.0)
+    invert = str(header.get('PhotometricInterpretation', '')) == 'MONOCHROME1'
+    return slope, intercept, invert
+
+
+def header_window(header):
+    """(center, width) from WindowCenter/WindowWidth, or None when the header has no window"""
+    center = first_value(header.get('WindowCenter'))
+    width = first_value(header.get('WindowWidth'))
+    if center is None or width is None or float(width) <= 0:
+        return None
+    return float(center), float(width)
+
+
+def auto_window(frames, transform):
+    """Window spanning the rescaled value range of a few sample frames"""
+    slope, intercept, _ = transform
+    low = min(float(frame.min()) for frame in frames) * slope + intercept
+    high = max(float(frame.max()) for frame in frames) * slope + intercept
+    low, high = min(low, high), max(low, high)
+    return (low + high) / 2.0, max(high - low, 1.0)
+
+
+def stored_value_table(dtype):
+    """Every value a <=16-bit integer dtype can hold, ordered by its unsigned bit pattern"""
+    unsigned = np.dtype(f'u{dtype.itemsize}')
+    return np.arange(2 ** (8 * dtype.itemsize), dtype=unsigned).view(dtype)
+
+
+@lru_cache(maxsize=32)
+def window_lut(dtype_str, slope, intercept, center, width, invert):
+    """Lookup table mapping each stored value straight to its windowed 8-bit display value"""
+    values = stored_value_table(np.dtype(dtype_str)).astype(np.float32) * slope + intercept
+    # Linear VOI function from DICOM PS3.3 C.11.2.1.2
+    lut = ((values - (center - 0.5)) / max(width - 1.0, 1.0) + 0.5) * 255.0
+    np.clip(lut, 0, 255, out=lut)
+    lut = lut.astype(np.uint8)
+    return 255 - lut if invert else lut
+
+
+def voi_lut_table(dicom_data, dtype):
+    """8-bit lookup table built from a dataset's Modality LUT and VOI LUT Sequence"""
+    values = apply_voi_lut(apply_modality_lut(stored_value_table(dtype), dicom_data), dicom_data).astype(np.float32)
+    low, high = float(values.min()), float(values.max())
+    lut = ((values - low) * (255.0 / max(high - low, 1.0))).astype(np.uint8)
+    return 255 - lut if str(dicom_data.get('PhotometricInterpretation', '')) == 'MONOCHROME1' else lut
+
+
+def apply_lut(pixels, lut):
+    """Index a lookup table by the stored pixel values without any float temporaries"""
+    if not pixels.dtype.isnative:
+        pixels = pixels.astype(pixels.dtype.newbyteorder('='))  # Big endian files only
+    if pixels.dtype.kind == 'i':
+        pixels = pixels.view(f'u{pixels.dtype.itemsize}')
+    return np.take(lut, pixels)
+
+
+def apply_window(pixels, transform, window):
+    """Render stored pixel values to a contiguous uint8 slice through rescale and window"""
+    slope, intercept, invert = transform
+    center, width = window
+    if pixels.dtype.kind in 'ui' and pixels.dtype.itemsize <= 2:
+        dtype_str = pixels.dtype.newbyteorder('=').str
+        return apply_lut(pixels, window_lut(dtype_str, slope, intercept, center, width, invert))
+
+    # 32-bit and float data is too wide for a table; compute in float32 in place
+    values = pixels.astype(np.float32)
+    values *= slope * 255.0 / max(width - 1.0, 1.0)
+    values += (intercept - (center - 0.5)) * 255.0 / max(width - 1.0, 1.0) + 127.5
+    np.clip(values, 0, 255, out=values)
+    image_data = values.astype(np.uint8)
+    return 255 - image_data if invert else image_data
+
+
+def cine_frame_interval_ms(dicom_data, default=100.0):
+    """Frame interval for cine playback from FrameTime, CineRate or RecommendedDisplayFrameRate"""
+    if dicom_data is not None:
+        frame_time = dicom_data.get('FrameTime')
+        if frame_time and float(frame_time) > 0:
+            return float(frame_time)
+        for rate_keyword in ('CineRate', 'RecommendedDisplayFrameRate'):
+            rate = dicom_data.get(rate_keyword)
+            if rate and float(rate) > 0:
+                return 1000.0 / float(rate)
+    return default
+
+
+def build_cine_frames(video_frames, display_size, render_frame):
+    """Render every frame once and scale it to a display-sized 8-bit QImage"""
+    frames = []
+    for frame_index in range(video_frames.shape[0]):
+        frame_data = render_frame(video_frames[frame_index])
+        qimage = QImage(frame_data.data, frame_data.shape[1], frame_data.shape[0],
+                        frame_data.shape[1], QImage.Format_Grayscale8)
+        # scaled() returns an image that owns its pixels, so frame_data can be released
+        frames.append(qimage.scaled(display_size, display_size, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+    return frames
+
+
+class SliceCache:
+    """Thread-safe LRU cache bounded by the total size of its entries in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            # Evict least recently used entries, always keeping the newest one
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+class DicomFileRecord:
+    """Small per-file metadata record built from a header-only read"""
+    __slots__ = ('file_path', 'sop_instance_uid', 'study_instance_uid', 'series_instance_uid',
+                 'series_number', 'series_description', 'modality', 'instance_number',
+                 'image_position', 'image_orientation', 'rows', 'columns', 'number_of_frames',
+                 'transform', 'window', 'has_pixels', 'pixels')
+
+    def __init__(self, file_path, header):
+        self.file_path = file_path
+        self.sop_instance_uid = str(header.get('SOPInstanceUID', ''))
+        self.study_instance_uid = str(header.get('StudyInstanceUID', ''))
+        self.series_instance_uid = str(header.get('SeriesInstanceUID', ''))
+        self.series_number = int(header.get('SeriesNumber') or 0)
+        self.series_description = str(header.get('SeriesDescription', ''))
+        self.modality = str(header.get('Modality', ''))
+        self.instance_number = int(header.get('InstanceNumber') or 0)
+        position = header.get('ImagePositionPatient')
+        self.image_position = tuple(float(v) for v in position) if position and len(position) == 3 else None
+        orientation = header.get('ImageOrientationPatient')
+        self.image_orientation = tuple(float(v) for v in orientation) if orientation and len(orientation) == 6 else None
+        self.rows = int(header.get('Rows') or 0)
+        self.columns = int(header.get('Columns') or 0)
+        self.number_of_frames = int(header.get('NumberOfFrames') or 1)
+        self.transform = pixel_transform(header)
+        self.window = header_window(header)
+        # Pixel data is not read in a header-only scan, so rely on the image size tags
+        self.has_pixels = self.rows > 0 and self.columns > 0
+        # Slice decoded ahead of time by the folder loader (first page only)
+        self.pixels = None
+
+    def to_state(self):
+        """Plain values for storing the record in the catalog (decoded pixels are left out)"""
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'pixels'}
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a record from to_state() values without reading the file"""
+        record = cls.__new__(cls)
+        for name in cls.__slots__:
+            value = state.get(name)
+            setattr(record, name, tuple(value) if isinstance(value, list) else value)
+        return record
+
+    def read_image(self):
+        """Read the file again, this time with pixel data, and return a 2D slice"""
+        if self.pixels is not None:
+            return self.pixels
+        if self.number_of_frames > 1:
+            # Only the first frame is shown for a multi-frame file, so avoid decoding the rest
+            header = pydicom.dcmread(self.file_path, defer_size=1024)
+            frames = memory_map_frames(self.file_path, header)
+            if frames is not None:
+                return np.array(extract_display_slice(frames[0]))
+            frames = open_encapsulated_frames(self.file_path, header)
+            if frames is not None:
+                first_frame = frames[0]
+                frames.close()
+                return first_frame
+        with PERF.stage('dcmread'):
+            dicom_data = pydicom.dcmread(self.file_path)
+        if 'PixelData' not in dicom_data:
+            return None
+        with PERF.stage('decode'):
+            return extract_display_slice(dicom_data.pixel_array)
+
+
+def raw_pixel_data_element(dicom_data):
+    """The PixelData element as read from the file, without loading a deferred value"""
+    try:
+        return dicom_data.get_item('PixelData', keep_deferred=True)
+    except TypeError:  # pydicom < 2.4 has no keep_deferred
+        return dicom_data.get_item('PixelData')
+
+
+class SignExtendedFrames:
+    """Frame-indexable view of memory-mapped signed frames stored in fewer bits than allocated
+
+    The bits above BitsStored are not part of the value, so each indexed frame is shifted up and
+    back down to sign-extend it, as pixel_array does for the whole array.
+    """
+
+    def __init__(self, pixels, bits_stored):
+        self.pixels = pixels
+        self.shift = pixels.dtype.itemsize * 8 - bits_stored
+        self.dtype = pixels.dtype.newbyteorder('=')
+        self.shape = pixels.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        frame = np.array(self.pixels[index], dtype=self.dtype)
+        frame <<= self.shift
+        frame >>= self.shift
+        return frame
+
+
+def memory_map_frames(file_path, dicom_data=None):
+    """Zero-copy view of uncompressed multi-frame PixelData, or None if it cannot be mapped
+
+    The PixelData element is located in the file and memory-mapped, so only the frames that are
+    actually indexed are read from disk. Grayscale data is (frames, rows, columns) and color data
+    (frames, rows, columns, samples), as pixel_array would return it.
+    """
+    if dicom_data is None:
+        dicom_data = pydicom.dcmread(file_path, defer_size=1024)
+    file_meta = getattr(dicom_data, 'file_meta', None)
+    byte_order = UNCOMPRESSED_TRANSFER_SYNTAXES.get(str(getattr(file_meta, 'TransferSyntaxUID', '')))
+    if byte_order is None or 'PixelData' not in dicom_data:
+        return None
+    bits_allocated = int(dicom_data.get('BitsAllocated') or 0)
+    if bits_allocated not in (8, 16, 32):
+        return None
+
+    # A deferred element is still raw and knows where its value starts
+    raw_element = raw_pixel_data_element(dicom_data)
+    value_offset = getattr(raw_element, 'value_tell', None)
+    if value_offset is None or raw_element.length == 0xFFFFFFFF:
+        return None
+
+    frames = int(dicom_data.get('NumberOfFrames') or 1)
+    rows, columns = int(dicom_data.Rows), int(dicom_data.Columns)
+    samples = int(dicom_data.get('SamplesPerPixel') or 1)
+    planar = samples > 1 and int(dicom_data.get('PlanarConfiguration') or 0) == 1
+    signed = int(dicom_data.get('PixelRepresentation') or 0) == 1
+    bits_stored = int(dicom_data.get('BitsStored') or bits_allocated)
+    sign_extend = signed and bits_stored < bits_allocated
+    if sign_extend and samples > 1:
+        return None
+    dtype = np.dtype(f'{byte_order}{"i" if signed else "u"}{bits_allocated // 8}')
+    if samples == 1:
+        shape = (frames, rows, columns)
+    elif planar:
+        shape = (frames, samples, rows, columns)
+    else:
+        shape = (frames, rows, columns, samples)
+    if int(np.prod(shape)) * dtype.itemsize > raw_element.length:
+        return None
+
+    pixels = np.memmap(file_path, dtype=dtype, mode='r', offset=value_offset, shape=shape)
+    if sign_extend:
+        return SignExtendedFrames(pixels, bits_stored)
+    return np.moveaxis(pixels, 1, -1) if planar else pixels
+
+
+# Tags a single compressed frame needs in order to be decoded on its own
+FRAME_DECODE_TAGS = ['Rows', 'Columns', 'SamplesPerPixel', 'PhotometricInterpretation', 'BitsAllocated',
+                     'BitsStored', 'HighBit', 'PixelRepresentation', 'PlanarConfiguration']
+# Start-of-codestream markers used to split fragments into frames when there is no offset table
+FRAME_START_MARKERS = (b'\xff\xd8', b'\xff\x4f')  # JPEG SOI, JPEG 2000 SOC
+
+
+def read_encapsulated_items(file, start, end=None):
+    """Yield (item offset, value length) for encapsulated items from start until end or the delimiter"""
+    file.seek(start)
+    while end is None or file.tell() < end:
+        header = file.read(8)
+        if len(header) < 8:
+            return
+        group, element, length = struct.unpack('<HHI', header)
+        if (group, element) == (0xFFFE, 0xE0DD):  # Sequence Delimitation Item
+            return
+        if (group, element) != (0xFFFE, 0xE000):
+            raise ValueError(f"Unexpected tag ({group:04X},{element:04X}) in encapsulated pixel data")
+        yield file.tell() - 8, length
+        file.seek(length, 1)
+
+
+class EncapsulatedFrames:
+    """Frame-indexable view of compressed multi-frame PixelData that decodes frames on demand
+
+    Frame boundaries come from the Extended Offset Table, the Basic Offset Table or, when both
+    are empty, from the fragment layout. Only the fragments of a requested frame are read and
+    decoded, and decoded frames are kept in a bounded cache shared with a prefetch pool.
+    """
+
+    def __init__(self, file_path, dicom_data, frame_ranges, cache_bytes=256 * 1024 * 1024, max_workers=None):
+        self.file_path = file_path
+        self.frame_ranges = frame_ranges
+        self.transfer_syntax = dicom_data.file_meta.TransferSyntaxUID
+        self.decode_tags = {keyword: dicom_data.get(keyword) for keyword in FRAME_DECODE_TAGS
+                            if keyword in dicom_data}
+        self._frames = SliceCache(cache_bytes)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count())
+
+        try:
+            first_frame = self._decode_and_store(0)
+        except Exception:
+            self._pool.shutdown(cancel_futures=True)  # Nobody will call close() on a half-built instance
+            raise
+        self.dtype = first_frame.dtype
+        self.shape = (len(frame_ranges),) + first_frame.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        index = range(self.shape[0])[index]
+        frame = self._frames.get(index)
+        if frame is not None:
+            return frame
+        with self._lock:
+            future = self._pending.get(index)
+        if future is not None:
+            return future.result()
+        return self._decode_and_store(index)
+
+    def prefetch(self, indices):
+        """Decode frames ahead of time on the worker pool"""
+        for index in indices:
+            if index in self._frames:
+                continue
+            with self._lock:
+                if index in self._pending:
+                    continue
+                future = self._pending[index] = self._pool.submit(self._decode_and_store, index)
+            # Outside the lock: the callback runs right away, and takes the lock, if the frame is already done
+            future.add_done_callback(lambda done, index=index: self._forget(index, done))
+
+    def _forget(self, index, future):
+        with self._lock:
+            if self._pending.get(index) is future:
+                del self._pending[index]
+
+    def read_frame_bytes(self, index):
+        start, end = self.frame_ranges[index]
+        with open(self.file_path, 'rb') as file:
+            fragments = []
+            for item_offset, length in list(read_encapsulated_items(file, start, end)):
+                file.seek(item_offset + 8)
+                fragments.append(file.read(length))
+        return b''.join(fragments)
+
+    def decode_frame(self, index):
+        frame_data = Dataset()
+        frame_data.file_meta = FileMetaDataset()
+        frame_data.file_meta.TransferSyntaxUID = self.transfer_syntax
+        for keyword, value in self.decode_tags.items():
+            setattr(frame_data, keyword, value)
+        frame_data.NumberOfFrames = 1
+        frame_data.PixelData = encapsulate([self.read_frame_bytes(index)])
+        frame_data['PixelData'].VR = 'OB'
+        frame_data['PixelData'].is_undefined_length = True
+        with PERF.stage('decode', frame=index):
+            return np.ascontiguousarray(extract_display_slice(frame_data.pixel_array))
+
+    def _decode_and_store(self, index):
+        frame = self.decode_frame(index)
+        self._frames.put(index, frame, frame.nbytes)
+        return frame
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def open_encapsulated_frames(file_path, dicom_data=None):
+    """EncapsulatedFrames for a compressed multi-frame file, or None when frames cannot be located"""
+    if dicom_data is None:
+        dicom_data = pydicom.dcmread(file_path, defer_size=1024)
+    file_meta = getattr(dicom_data, 'file_meta', None)
+    transfer_syntax = getattr(file_meta, 'TransferSyntaxUID', None)
+    if transfer_syntax is None or not transfer_syntax.is_compressed or 'PixelData' not in dicom_data:
+        return None
+    raw_element = raw_pixel_data_element(dicom_data)
+    value_offset = getattr(raw_element, 'value_tell', None)
+    if value_offset is None:
+        return None
+    num_frames = int(dicom_data.get('NumberOfFrames') or 1)
+
+    try:
+        with open(file_path, 'rb') as file:
+            items = read_encapsulated_items(file, value_offset)
+            table_offset, table_length = next(items)
+            # Offsets in both tables are relative to the first fragment after the Basic Offset Table
+            first_fragment = table_offset + 8 + table_length
+            if 'ExtendedOffsetTable' in dicom_data:
+                offsets = np.frombuffer(dicom_data.ExtendedOffsetTable, dtype='<u8').tolist()
+            elif table_length:
+                file.seek(table_offset + 8)
+                offsets = list(struct.unpack(f'<{table_length // 4}I', file.read(table_length)))
+            else:
+                offsets = None
+
+            if offsets is not None:
+                starts = [first_fragment + offset for offset in offsets]
+                frame_ranges = list(zip(starts, starts[1:] + [None]))
+            else:
+                # No offset table: one fragment per frame, or split on codestream start markers
+                fragments = list(read_encapsulated_items(file, first_fragment))
+                if len(fragments) == num_frames:
+                    frame_ranges = [(offset, offset + 8 + length) for offset, length in fragments]
+                else:
+                    starts = []
+                    for offset, _ in fragments:
+                        file.seek(offset + 8)
+                        if file.read(2) in FRAME_START_MARKERS:
+                            starts.append(offset)
+                    frame_ranges = list(zip(starts, starts[1:] + [None]))
+        if len(frame_ranges) != num_frames:
+            return None
+        return EncapsulatedFrames(file_path, dicom_data, frame_ranges)
+    except Exception as e:
+        print(f"Per-frame decoding unavailable for {os.path.basename(file_path)}: {e}")
+        return None
+
+
+def read_dicom_header(file_path):
+    """Read a DICOM file up to (not including) the pixel data and build its record"""
+    header = pydicom.dcmread(file_path, stop_before_pixels=True)
+    return DicomFileRecord(file_path, header)
+
+
+def slice_normal(record):
+    """Unit normal of a slice from ImageOrientationPatient, or None without orientation"""
+    if record.image_orientation is None:
+        return None
+    return np.cross(np.array(record.image_orientation[:3]), np.array(record.image_orientation[3:]))
+
+
+def slice_sort_key(record):
+    """Sort key placing a slice by its position along the slice normal, then by instance number"""
+    normal = slice_normal(record)
+    if record.image_position is not None and normal is not None:
+        return 0, float(np.dot(normal, record.image_position)), record.instance_number, record.file_path
+    return 1, 0.0, record.instance_number, record.file_path
+
+
+class ComparisonSeries:
+    """One series of a side-by-side comparison and its slice positions in patient coordinates"""
+    __slots__ = ('key', 'records', 'normal', 'positions')
+
+    def __init__(self, key, records):
+        self.key = key
+        self.records = [record for record in records if record.has_pixels]
+        self.normal = slice_normal(self.records[0]) if self.records else None
+        self.positions = None
+        if self.normal is not None and all(record.image_position is not None for record in self.records):
+            # Records are already sorted along the normal, so these positions ascend
+            self.positions = [float(np.dot(self.normal, record.image_position)) for record in self.records]
+
+    def __len__(self):
+        return len(self.records)
+
+    def matching_slice(self, reference, index):
+        """Index of the slice at the same patient position as reference slice index, or None if outside
+
+        Series without positions, or cut in a different orientation, fall back to the same fraction
+        of the way through the series.
+        """
+        if reference is self:
+            return index
+        reference_record = reference.records[index]
+        if self.positions is not None and reference_record.image_position is not None and \
+                reference.normal is not None and abs(float(np.dot(self.normal, reference.normal))) > 0.99:
+            position = float(np.dot(self.normal, reference_record.image_position))
+            nearest = bisect.bisect_left(self.positions, position)
+            candidates = [i for i in (nearest - 1, nearest) if 0 <= i < len(self.positions)]
+            nearest = min(candidates, key=lambda i: abs(self.positions[i] - position))
+            spacing = abs(self.positions[-1] - self.positions[0]) / max(len(self.positions) - 1, 1) or 1.0
+            return nearest if abs(self.positions[nearest] - position) <= spacing else None
+        fraction = index / max(len(reference) - 1, 1)
+        return int(round(fraction * (len(self) - 1)))
+
+
+class DicomSeriesIndex:
+    """In-memory index of StudyInstanceUID -> SeriesInstanceUID -> sorted instances"""
+
+    def __init__(self):
+        self.studies = {}
+        self.instances = {}  # SOPInstanceUID -> record
+        self._unsorted = set()
+
+    def clear(self):
+        self.studies.clear()
+        self.instances.clear()
+        self._unsorted.clear()
+
+    def add(self, records):
+        for record in records:
+            series = self.studies.setdefault(record.study_instance_uid, {})
+            series.setdefault(record.series_instance_uid, []).append(record)
+            if record.sop_instance_uid:
+                self.instances[record.sop_instance_uid] = record
+            self._unsorted.add((record.study_instance_uid, record.series_instance_uid))
+
+    def series_keys(self):
+        """All (study UID, series UID) pairs, largest series first"""
+        keys = [(study_uid, series_uid)
+                for study_uid, series in self.studies.items() for series_uid in series]
+        return sorted(keys, key=lambda key: -len(self.studies[key[0]][key[1]]))
+
+    def series(self, study_uid, series_uid):
+        """Instances of a series sorted by slice position (or instance number)"""
+        instances = self.studies.get(study_uid, {}).get(series_uid, [])
+        if (study_uid, series_uid) in self._unsorted:
+            instances.sort(key=slice_sort_key)
+            self._unsorted.discard((study_uid, series_uid))
+        return instances
+
+    def describe_series(self, study_uid, series_uid):
+        instances = self.studies[study_uid][series_uid]
+        first = instances[0]
+        description = first.series_description or first.series_instance_uid
+        return f"{first.modality} #{first.series_number} {description} ({len(instances)})"
+
+    def build_volume(self, study_uid, series_uid, max_workers=None):
+        """Decode a whole series into one contiguous (slices, rows, columns) array"""
+        instances = [record for record in self.series(study_uid, series_uid) if record.has_pixels]
+        if not instances:
+            return None
+
+        first_slice = instances[0].read_image()
+        volume = np.empty((len(instances),) + first_slice.shape, dtype=first_slice.dtype)
+        volume[0] = first_slice
+
+        def fill_slice(index):
+            image_data = instances[index].read_image()
+            if image_data is None or image_data.shape != first_slice.shape:
+                raise ValueError(f"Slice {instances[index].file_path} does not match the series matrix size")
+            volume[index] = image_data
+
+        # pydicom decoders release the GIL for most of the work, so threads are enough here
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+            list(pool.map(fill_slice, range(1, len(instances))))
+        return volume
+
+
+# Catalog column -> DICOM keyword for the tags indexed across every scanned file
+CATALOG_TAGS = {
+    'patient_name': 'PatientName',
+    'patient_id': 'PatientID',
+    'patient_birth_date': 'PatientBirthDate',
+    'study_instance_uid': 'StudyInstanceUID',
+    'study_date': 'StudyDate',
+    'study_description': 'StudyDescription',
+    'accession_number': 'AccessionNumber',
+    'series_instance_uid': 'SeriesInstanceUID',
+    'series_date': 'SeriesDate',
+    'series_description': 'SeriesDescription',
+    'modality': 'Modality',
+    'referring_physician': 'ReferringPhysicianName',
+    'performing_physician': 'PerformingPhysicianName',
+    'institution': 'InstitutionName',
+}
+INDEXED_CATALOG_COLUMNS = ['patient_id', 'patient_name', 'study_instance_uid', 'series_instance_uid',
+                           'modality', 'study_date', 'referring_physician']
+
+
+def catalog_entry(file_path, header, record):
+    """Catalog row for one file: its stat signature, the indexed tags and the viewer record"""
+    stat = os.stat(file_path)
+    entry = {column: str(header.get(keyword, '')) for column, keyword in CATALOG_TAGS.items()}
+    entry.update(path=file_path, mtime=stat.st_mtime, size=stat.st_size, record=json.dumps(record.to_state()))
+    return entry
+
+
+class DicomCatalog:
+    """Persistent SQLite catalog of scanned DICOM headers for fast search and re-opening"""
+
+    def __init__(self, database_path=None):
+        self.database_path = database_path or os.environ.get('DICOM_CATALOG') or \
+            os.path.join(os.path.expanduser('~'), '.dicom_viewer', 'catalog.sqlite3')
+        os.makedirs(os.path.dirname(os.path.abspath(self.database_path)), exist_ok=True)
+        # sqlite3 connections cannot be shared between threads, so keep one per thread
+        self._local = threading.local()
+        self.has_full_text = False
+        self._create_schema()
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.database_path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self):
+        connection = self.connection()
+        columns = ', '.join(f'{column} TEXT' for column in CATALOG_TAGS)
+        connection.execute(f'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                           f'{columns}, record TEXT)')
+        for column in INDEXED_CATALOG_COLUMNS:
+            connection.execute(f'CREATE INDEX IF NOT EXISTS files_{column} ON files ({column} COLLATE NOCASE)')
+        try:
+            connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(text)')
+            self.has_full_text = True
+        except sqlite3.OperationalError:
+            pass  # SQLite built without FTS5; search falls back to LIKE scans
+        connection.commit()
+
+    def lookup(self, file_paths):
+        """Records for the given paths whose size and modification time are unchanged"""
+        connection = self.connection()
+        records = {}
+        for start in range(0, len(file_paths), 500):
+            chunk = file_paths[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = connection.execute(f'SELECT path, mtime, size, record FROM files WHERE path IN ({placeholders})',
+                                      chunk)
+            for path, mtime, size, record in rows:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime == mtime and stat.st_size == size:
+                    records[path] = DicomFileRecord.from_state(json.loads(record))
+        return records
+
+    def store(self, entries):
+        """Insert or update catalog rows in a single transaction"""
+        if not entries:
+            return
+        connection = self.connection()
+        columns = ['path', 'mtime', 'size'] + list(CATALOG_TAGS) + ['record']
+        updates = ', '.join(f'{column}=excluded.{column}' for column in columns[1:])
+        with connection:
+            for entry in entries:
+                # An upsert keeps the rowid stable, so it can key the full-text row as well
+                connection.execute(f'INSERT INTO files ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                                   f'ON CONFLICT(path) DO UPDATE SET {updates}',
+                                   [entry[column] for column in columns])
+                if self.has_full_text:
+                    rowid = connection.execute('SELECT rowid FROM files WHERE path = ?', (entry['path'],)).fetchone()[0]
+                    connection.execute('INSERT OR REPLACE INTO files_fts (rowid, text) VALUES (?, ?)',
+                                       (rowid, ' '.join(entry[column] for column in CATALOG_TAGS)))
+
+    def search(self, text, limit=200):
+        """Find files by 'Keyword=value' (e.g. Modality=CT) or by free text over the indexed tags"""
+        connection = self.connection()
+        select = f'SELECT path, {", ".join(CATALOG_TAGS)} FROM files'
+        if '=' in text:
+            keyword, value = (part.strip() for part in text.split('=', 1))
+            column = next((column for column, tag in CATALOG_TAGS.items()
+                           if keyword.lower() in (column, tag.lower())), None)
+            if column is None:
+                return []
+            # A prefix LIKE can use the NOCASE index on indexed columns
+            rows = connection.execute(f'{select} WHERE {column} LIKE ? LIMIT ?', (value + '%', limit))
+        elif self.has_full_text:
+            terms = ' '.join('"' + term.replace('"', '""') + '"*' for term in text.split())
+            rows = connection.execute(f'{select} WHERE rowid IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?) '
+                                      f'LIMIT ?', (terms, limit))
+        else:
+            condition = ' OR '.join(f'{column} LIKE ?' for column in CATALOG_TAGS)
+            rows = connection.execute(f'{select} WHERE {condition} LIMIT ?',
+                                      ['%' + text + '%'] * len(CATALOG_TAGS) + [limit])
+        return [dict(zip(['path'] + list(CATALOG_TAGS), row)) for row in rows]
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def series_default_window(records):
+    """Header window of the first slice in a series, otherwise that slice's value range"""
+    for record in records:
+        if record.has_pixels:
+            if record.window is not None:
+                return record.window
+            image_data = record.read_image()
+            if image_data is not None:
+                return auto_window([image_data], record.transform)
+    return 40.0, 400.0
+
+
+def load_dicom_records(file_paths, decode_pixels=False):
+    """Worker task: read a chunk of headers, optionally decoding their pixels too
+
+    Stage timings are returned as well, since a worker process's PERF totals never reach the viewer.
+    """
+    records, entries, errors, timings = [], [], [], []
+    for file_path in file_paths:
+        try:
+            if decode_pixels:
+                with PERF.stage('dcmread', timings):
+                    dicom_data = pydicom.dcmread(file_path)
+                record = DicomFileRecord(file_path, dicom_data)
+                if 'PixelData' in dicom_data:
+                    with PERF.stage('decode', timings):
+                        record.pixels = extract_display_slice(dicom_data.pixel_array)
+            else:
+                with PERF.stage('dcmread_header', timings):
+                    dicom_data = pydicom.dcmread(file_path, stop_before_pixels=True)
+                record = DicomFileRecord(file_path, dicom_data)
+            records.append(record)
+            entries.append(catalog_entry(file_path, dicom_data, record))
+        except Exception as e:
+            errors.append(f"Error loading {os.path.basename(file_path)}: {e}")
+    return records, entries, errors, timings
+
+
+class DicomFolderLoader(QThread):
+    """Scan a DICOM folder on a worker pool and send the records back in batches
+
+    Once every header is in, the first preload_count slices of the largest series, in sorted
+    position order, are decoded on the pool and sent as page_decoded.
+    """
+    batch_loaded = pyqtSignal(list)
+    page_decoded = pyqtSignal(list)  # Records of the first page, with their pixels decoded
+    progress = pyqtSignal(int, int)
+    finished_loading = pyqtSignal(bool)  # True when the scan was cancelled
+
+    def __init__(self, folder_path, preload_count=0, max_workers=None, use_processes=True, catalog_path=None,
+                 parent=None):
+        super().__init__(parent)
+        self.folder_path = folder_path
+        self.catalog_path = catalog_path
+        self.preload_count = preload_count
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self):
+        file_paths = sorted(os.path.join(self.folder_path, filename)
+                            for filename in os.listdir(self.folder_path) if filename.endswith('.dcm'))
+        total = len(file_paths)
+        self.progress.emit(0, total)
+
+        # Files already in the catalog with an unchanged size and mtime need no parsing
+        catalog = None
+        cached_records = {}
+        try:
+            catalog = DicomCatalog(self.catalog_path)
+            cached_records = catalog.lookup(file_paths)
+        except Exception as e:
+            print(f"DICOM catalog unavailable: {e}")
+        done = len(cached_records)
+        cached = list(cached_records.values())
+        # The first page comes from the sorted series, so it needs every header
+        series_index = DicomSeriesIndex()
+        series_index.add(cached)
+        for start in range(0, len(cached), 512):
+            self.batch_loaded.emit(cached[start:start + 512])
+        self.progress.emit(done, total)
+        remaining_paths = [path for path in file_paths if path not in cached_records]
+
+        # Small chunks spread a small folder over every worker; larger ones cut pool overhead on big series
+        chunk_size = max(1, min(64, len(remaining_paths) // (self.max_workers * 4)))
+        chunks = [remaining_paths[start:start + chunk_size] for start in range(0, len(remaining_paths), chunk_size)]
+
+        if self.use_processes:
+            executor = process_pool(self.max_workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = [executor.submit(load_dicom_records, paths) for paths in chunks]
+            for future in as_completed(futures):
+                if self._cancel_event.is_set():
+                    break
+                try:
+                    records, entries, errors, timings = future.result()
+                except Exception as e:
+                    print(f"Error in folder loader: {e}")
+                    continue
+                if self.use_processes:
+                    PERF.merge(timings)  # Threads record into this process's PERF directly
+                if catalog is not None:
+                    try:
+                        catalog.store(entries)
+                    except Exception as e:
+                        print(f"Error updating DICOM catalog: {e}")
+                for error in errors:
+                    print(error)
+                done += len(records) + len(errors)
+                if records:
+                    series_index.add(records)
+                    self.batch_loaded.emit(records)
+                self.progress.emit(done, total)
+
+            if self.preload_count and series_index.studies and not self._cancel_event.is_set():
+                first_page = series_index.series(*series_index.series_keys()[0])[:self.preload_count]
+                page_futures = [executor.submit(load_dicom_records, [record.file_path], True)
+                                for record in first_page if record.has_pixels]
+                decoded = []
+                for future in page_futures:
+                    try:
+                        records, _, errors, timings = future.result()
+                    except Exception as e:
+                        print(f"Error in folder loader: {e}")
+                        continue
+                    if self.use_processes:
+                        PERF.merge(timings)
+                    decoded.extend(records)
+                    for error in errors:
+                        print(error)
+                if decoded and not self._cancel_event.is_set():
+                    self.page_decoded.emit(decoded)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if catalog is not None:
+                catalog.close()
+
+        self.finished_loading.emit(self._cancel_event.is_set())
+
+
+def content_type_parameters(content_type):
+    """Media type and lowercased parameters of a Content-Type header"""
+    media_type, *parameters = content_type.split(';')
+    values = {}
+    for parameter in parameters:
+        name, _, value = parameter.strip().partition('=')
+        values[name.lower()] = value.strip().strip('"')
+    return media_type.strip().lower(), values
+
+
+def iter_multipart_parts(stream, boundary, length, chunk_size=1024 * 1024):
+    """Yield the body of each part of a multipart stream as soon as that part has arrived"""
+    delimiter = b'\r\n--' + boundary.encode()
+    buffer = bytearray(b'\r\n')  # The first delimiter has no leading CRLF when there is no preamble
+    remaining = length
+    search_from = 0
+    in_part = False
+    while True:
+        position = buffer.find(delimiter, search_from)
+        # Two bytes after a delimiter tell whether it closes the body ("--")
+        if position < 0 or len(buffer) < position + len(delimiter) + 2:
+            if remaining <= 0:
+                return
+            chunk = stream.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            if position < 0:
+                search_from = max(0, len(buffer) - len(delimiter) + 1)
+            buffer += chunk
+            continue
+        if in_part:
+            _, _, body = bytes(buffer[:position]).partition(b'\r\n\r\n')
+            yield body
+        in_part = True
+        del buffer[:position + len(delimiter)]
+        search_from = 0
+        if buffer.startswith(b'--'):
+            return
+
+
+def sop_reference(header, failure_reason=None):
+    """One item of a STOW-RS response sequence, in the DICOM JSON model"""
+    item = {}
+    for tag, keyword in (('00081150', 'SOPClassUID'), ('00081155', 'SOPInstanceUID')):
+        value = header.get(keyword) if header is not None else None
+        item[tag] = {'vr': 'UI', 'Value': [str(value)]} if value else {'vr': 'UI'}
+    if failure_reason is not None:
+        item['00081197'] = {'vr': 'US', 'Value': [failure_reason]}
+    return item
+
+
+class StowRequestHandler(BaseHTTPRequestHandler):
+    """Minimal STOW-RS endpoint: POST /studies with multipart/related application/dicom parts"""
+
+    def do_POST(self):
+        if not self.path.rstrip('/').split('?')[0].startswith('/studies'):
+            self.send_error(404, "Only /studies accepts instances")
+            return
+        media_type, parameters = content_type_parameters(self.headers.get('Content-Type', ''))
+        length = int(self.headers.get('Content-Length') or 0)
+        if media_type == 'multipart/related' and 'boundary' in parameters:
+            parts = iter_multipart_parts(self.rfile, parameters['boundary'], length)
+        elif media_type == 'application/dicom':
+            parts = [self.rfile.read(length)]
+        else:
+            self.send_error(415, "Expected multipart/related or application/dicom")
+            return
+
+        stored, failed = [], []
+        for part in parts:
+            header = None
+            try:
+                header = pydicom.dcmread(io.BytesIO(part), stop_before_pixels=True)
+                self.server.ingest.store_bytes(part, header)
+                stored.append(sop_reference(header))
+            except Exception as e:
+                print(f"Rejected received instance: {e}")
+                failed.append(sop_reference(header, STOW_CANNOT_UNDERSTAND))
+        response = {}
+        if stored:
+            response['00081199'] = {'vr': 'SQ', 'Value': stored}  # ReferencedSOPSequence
+        if failed:
+            response['00081198'] = {'vr': 'SQ', 'Value': failed}  # FailedSOPSequence
+        body = json.dumps(response).encode()
+        self.send_response(409 if failed and not stored else 200)
+        self.send_header('Content-Type', 'application/dicom+json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per request would flood the console during a large transfer
+
+
+class DicomIngestServer(QObject):
+    """Receive instances over a local DICOMweb (STOW-RS) endpoint and, with pynetdicom, C-STORE
+
+    Each instance is written under storage_dir and announced with instance_received as soon as it
+    arrives, so a series can be shown while the rest of it is still being transferred.
+    """
+    instance_received = pyqtSignal(object)
+
+    def __init__(self, storage_dir=INGEST_DIR, http_port=8042, dimse_port=11112, ae_title='DICOMVIEWER',
+                 catalog_path=None, parent=None):
+        super().__init__(parent)
+        self.storage_dir = storage_dir
+        self.http_port = http_port
+        self.dimse_port = dimse_port
+        self.ae_title = ae_title
+        self.catalog_path = catalog_path
+        self.catalog = None
+        self.http_server = None
+        self.dimse_server = None
+
+    def start(self):
+        os.makedirs(self.storage_dir, exist_ok=True)
+        try:
+            self.catalog = DicomCatalog(self.catalog_path)
+        except Exception as e:
+            print(f"DICOM catalog unavailable: {e}")
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', self.http_port), StowRequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.ingest = self
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        print(f"Receiving DICOMweb instances at http://127.0.0.1:{self.http_port}/studies")
+
+        if AE is not None and self.dimse_port:
+            ae = AE(ae_title=self.ae_title)
+            ae.supported_contexts = StoragePresentationContexts
+            try:
+                self.dimse_server = ae.start_server(('127.0.0.1', self.dimse_port), block=False,
+                                                    evt_handlers=[(evt.EVT_C_STORE, self.handle_c_store)])
+            except Exception:
+                self.stop()  # Release the HTTP port too, so a retry can bind both again
+                raise
+            print(f"Receiving C-STORE as {self.ae_title} on port {self.dimse_port}")
+        elif self.dimse_port:
+            print("pynetdicom is not installed; C-STORE receiving is disabled")
+
+    def stop(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+        if self.dimse_server is not None:
+            self.dimse_server.shutdown()
+            self.dimse_server = None
+
+    def instance_path(self, header):
+        """Where a received instance is written; raises ValueError for UIDs that could leave storage_dir"""
+        uids = []
+        for keyword in ('StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID'):
+            uid = str(header.get(keyword, ''))
+            if not DICOM_UID_PATTERN.fullmatch(uid):
+                raise ValueError(f"Invalid {keyword} {uid!r}")
+            uids.append(uid)
+        file_path = os.path.join(self.storage_dir, uids[0], uids[1], uids[2] + '.dcm')
+        # A UID such as ".." passes the pattern, so check where the path really ends up
+        if not os.path.realpath(file_path).startswith(os.path.realpath(self.storage_dir) + os.sep):
+            raise ValueError(f"Instance path {file_path!r} is outside {self.storage_dir!r}")
+        return file_path
+
+    def store_bytes(self, data, header=None):
+        """Store one Part 10 file received over DICOMweb"""
+        if header is None:
+            header = pydicom.dcmread(io.BytesIO(data), stop_before_pixels=True)
+        file_path = self.instance_path(header)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path + '.partial', 'wb') as output:
+            output.write(data)
+        os.replace(file_path + '.partial', file_path)
+        return self.announce(file_path, header)
+
+    def handle_c_store(self, event):
+        try:
+            dicom_data = event.dataset
+            dicom_data.file_meta = event.file_meta
+            file_path = self.instance_path(dicom_data)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            save_dataset(dicom_data, file_path + '.partial')
+            os.replace(file_path + '.partial', file_path)
+            self.announce(file_path, dicom_data)
+        except Exception as e:
+            print(f"Error storing received instance: {e}")
+            return 0xC210  # Cannot understand
+        return 0x0000
+
+    def announce(self, file_path, header):
+        record = DicomFileRecord(file_path, header)
+        if self.catalog is not None:
+            try:
+                self.catalog.store([catalog_entry(file_path, header, record)])
+            except Exception as e:
+                print(f"Error updating DICOM catalog: {e}")
+        # Emitted from a server thread; Qt queues it to the viewer's thread
+        self.instance_received.emit(record)
+        return record
+
+
+def save_dataset(dicom_data, file_path):
+    """Write a dataset as a Part 10 file, with its file meta information, on pydicom 2 or 3"""
+    if PYDICOM_MAJOR_VERSION >= 3:
+        dicom_data.save_as(file_path, enforce_file_format=True)
+    else:
+        dicom_data.save_as(file_path, write_like_original=False)
+
+
+def send_dicom_files(input_dir, url):
+    """STOW-RS client: stream every DICOM file under input_dir to url in one multipart request"""
+    file_paths = [os.path.join(input_dir, relative_path) for relative_path in iter_dicom_files(input_dir)]
+    boundary = os.urandom(16).hex()
+    part_header = f'\r\n--{boundary}\r\nContent-Type: application/dicom\r\n\r\n'.encode()
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    length = sum(len(part_header) + os.path.getsize(path) for path in file_paths) + len(closing)
+
+    def body():
+        for file_path in file_paths:
+            yield part_header
+            with open(file_path, 'rb') as dicom_file:
+                while True:
+                    chunk = dicom_file.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    yield chunk
+        yield closing
+
+    target = urlsplit(url)
+    connection = http.client.HTTPConnection(target.hostname, target.port or 80)
+    start_time = time.perf_counter()
+    connection.request('POST', target.path or '/studies', body=body(), headers={
+        'Content-Type': f'multipart/related; type="application/dicom"; boundary={boundary}',
+        'Content-Length': str(length)})
+    response = connection.getresponse()
+    result = json.loads(response.read() or b'{}')
+    connection.close()
+    stored = result.get('00081199', {}).get('Value', [])
+    failed = result.get('00081198', {}).get('Value', [])
+    print(f"Sent {len(file_paths)} files in {time.perf_counter() - start_time:.1f} s: "
+          f"{len(stored)} stored, {len(failed)} failed (HTTP {response.status})")
+    return response.status == 200
+
 
 class DICOMViewer(QWidget):
     def __init__(self):
@@ -20,16 +1409,79 @@ class DICOMViewer(QWidget):
         self.dicom_files = []
         self.current_file_index = 0
         self.image_timer = QTimer(self)
+        self.image_timer.setTimerType(Qt.PreciseTimer)
         self.image_timer.timeout.connect(self.update_video_frame)
         self.current_video_frame = 0
+
+        # Cine playback state: frames are prepared once in play_video
+        self.video_label = QLabel(self)
+        self.video_label.setVisible(False)
+        self.cine_frames = []
+        self.cine_frame_count = 0
+        self.cine_lazy = False
+        self.cine_interval_ms = 100.0
+        self.cine_clock = QElapsedTimer()
+        self.cine_frames_shown = 0
+        self.cine_frames_dropped = 0
+        self.cine_achieved_fps = 0.0
+        self.cine_size = 800
+        self.folder_load_started = 0.0
         self.image_data_3d = None
         self.image_grid = QGridLayout()
         self.is_folder_view = False
+        self.folder_loader = None
+        self.first_page_shown = False
+        self.series_index = DicomSeriesIndex()
+        self.current_series = None
+        # Series shown side by side; they share the slice/pixmap caches and the prefetch pool
+        self.comparison = []
+        self.comparison_indices = []
+        # Instances arriving from the network are added to the index in batches
+        self.ingest_server = None
+        self.ingest_pending = []
+        self.ingest_timer = QTimer(self)
+        self.ingest_timer.timeout.connect(self.flush_received_instances)
+        # Pseudonym key shared with the batch mode; a random one is made on first use if unset
+        self.anonymization_secret = os.environ.get('DICOM_ANON_SECRET', '')
+        try:
+            self.catalog = DicomCatalog()
+        except Exception as e:
+            print(f"DICOM catalog unavailable: {e}")
+            self.catalog = None
+
+        # Rendered 8-bit slices (filled by the display and by prefetching) and scaled tile pixmaps
+        self.slice_cache = SliceCache(256 * 1024 * 1024)
+        self.pixmap_cache = SliceCache(128 * 1024 * 1024)
+        self.prefetch_pool = ThreadPoolExecutor(max_workers=2)
+        self.prefetch_futures = []
+        # Window/level shared by every slice of the current source, so brightness does not flicker
+        self.display_window = None
+        self.default_window = None
+        self.volume_transform = (1.0, 0.0, False)
+        self.voi_lut = None
+        self.single_image_data = None
+        self.view_mode = None
+        self.volume_id = 0
+
+        # Grid of reusable tile labels; only their pixmaps change between redraws
+        self.grid_display_size = 800
+        self.tile_labels = []
+        self.grid_rows = self.grid_cols = 2
+        self.tile_size = 400
 
         self.slice_slider = None
         self.current_slice_label = QLabel("Slice Range Start: -", self)
         self.slices_per_grid = 4
         self.init_ui()
+        self.build_tile_pool(2, 2)
+
+        # Debug overlay drawn over the image area
+        self.debug_overlay = QLabel(self)
+        self.debug_overlay.setStyleSheet("background-color: rgba(0, 0, 0, 170); color: #7CFC00; "
+                                         "font-family: monospace; padding: 4px;")
+        self.debug_overlay.setVisible(False)
+        self.debug_overlay_timer = QTimer(self)
+        self.debug_overlay_timer.timeout.connect(self.update_debug_overlay)
 
     def init_ui(self):
         # Add load folder button
@@ -39,12 +1491,24 @@ class DICOMViewer(QWidget):
         self.load_button = QPushButton("Load DICOM File", self)
         self.load_button.clicked.connect(self.load_dicom)
 
+        self.add_folder_button = QPushButton("Add DICOM Folder", self)
+        self.add_folder_button.setToolTip("Load another folder (e.g. a prior study) without closing the current one")
+        self.add_folder_button.clicked.connect(self.add_dicom_folder)
+
+        self.receive_button = QPushButton("Receive from PACS", self)
+        self.receive_button.setCheckable(True)
+        self.receive_button.setToolTip("Listen for DICOMweb STOW-RS (port 8042) and C-STORE (port 11112) transfers")
+        self.receive_button.toggled.connect(self.toggle_receiving)
+
         self.prefix_input = QLineEdit(self)
         self.prefix_input.setPlaceholderText("Enter anonymization prefix")
 
         self.search_input = QLineEdit(self)  # Search input field
         self.search_input.setPlaceholderText("Search tag keyword...")
 
+        self.search_input.setToolTip("Searches the loaded file and the catalog of scanned files.\n"
+                                     "Use Keyword=value (e.g. Modality=CT) to search one catalog tag.")
+
         self.search_button = QPushButton("Search Tags", self)  # Search button
         self.search_button.clicked.connect(self.search_tags)
 
@@ -75,6 +1539,9 @@ class DICOMViewer(QWidget):
         self.stop_button = QPushButton("Stop Video", self)
         self.stop_button.clicked.connect(self.stop_video)
 
+        self.debug_checkbox = QCheckBox("Debug Overlay", self)
+        self.debug_checkbox.toggled.connect(self.toggle_debug_overlay)
+
         self.dicom_info_text = QTextEdit(self)
         self.dicom_info_text.setReadOnly(True)
 
@@ -87,10 +1554,55 @@ class DICOMViewer(QWidget):
         nav_layout.addWidget(self.prev_button)
         nav_layout.addWidget(self.next_button)
 
+        # Grid layout for folder pages and multi-frame tiles
+        self.grid_layout_combo = QComboBox(self)
+        self.grid_layout_combo.addItems(["1x1", "2x2", "3x3", "4x4"])
+        self.grid_layout_combo.setCurrentText("2x2")
+        self.grid_layout_combo.activated[str].connect(self.set_grid_layout)
+
+        # Window/level controls
+        self.window_preset_combo = QComboBox(self)
+        self.window_preset_combo.addItems(["Default", "Auto (Min/Max)"] + list(CT_WINDOW_PRESETS))
+        self.window_preset_combo.activated[str].connect(self.apply_window_preset)
+        self.window_center_input = QSpinBox(self)
+        self.window_center_input.setRange(-4096, 65535)
+        self.window_center_input.setPrefix("Center: ")
+        self.window_center_input.valueChanged.connect(self.on_window_input_changed)
+        self.window_width_input = QSpinBox(self)
+        self.window_width_input.setRange(1, 65535)
+        self.window_width_input.setPrefix("Width: ")
+        self.window_width_input.valueChanged.connect(self.on_window_input_changed)
+        window_layout = QHBoxLayout()
+        window_layout.addWidget(self.window_center_input)
+        window_layout.addWidget(self.window_width_input)
+
+        # Series selection for folders holding more than one series
+        self.series_combo = QComboBox(self)
+        self.series_combo.currentIndexChanged.connect(self.select_series)
+        self.series_combo.setVisible(False)
+        self.volume_button = QPushButton("Open Series as Volume", self)
+        self.volume_button.clicked.connect(self.open_series_volume)
+        self.volume_button.setVisible(False)
+        self.compare_button = QPushButton("Add Series to Comparison", self)
+        self.compare_button.clicked.connect(self.add_series_to_comparison)
+        self.compare_button.setVisible(False)
+        self.clear_compare_button = QPushButton("Close Comparison", self)
+        self.clear_compare_button.clicked.connect(self.close_comparison)
+        self.clear_compare_button.setVisible(False)
+
+        # Folder loading progress
+        self.load_progress = QProgressBar(self)
+        self.load_progress.setVisible(False)
+        self.cancel_load_button = QPushButton("Cancel Loading", self)
+        self.cancel_load_button.clicked.connect(self.cancel_folder_loading)
+        self.cancel_load_button.setVisible(False)
+
         # Layout for buttons
         button_layout = QVBoxLayout()
         button_layout.addWidget(self.load_folder_button)
         button_layout.addWidget(self.load_button)
+        button_layout.addWidget(self.add_folder_button)
+        button_layout.addWidget(self.receive_button)
         button_layout.addWidget(self.prefix_input)
         button_layout.addWidget(self.search_input)
         button_layout.addWidget(self.search_button)
@@ -102,13 +1614,25 @@ class DICOMViewer(QWidget):
         button_layout.addWidget(self.image_button)
         button_layout.addWidget(self.all_tags_button)
         button_layout.addWidget(self.current_slice_label)
+        button_layout.addWidget(QLabel("Grid Layout:", self))
+        button_layout.addWidget(self.grid_layout_combo)
+        button_layout.addWidget(QLabel("Window/Level:", self))
+        button_layout.addWidget(self.window_preset_combo)
+        button_layout.addLayout(window_layout)
         button_layout.addWidget(self.play_button)
         button_layout.addWidget(self.stop_button)
+        button_layout.addWidget(self.debug_checkbox)
         button_layout.addLayout(nav_layout)
+        button_layout.addWidget(self.series_combo)
+        button_layout.addWidget(self.volume_button)
+        button_layout.addWidget(self.compare_button)
+        button_layout.addWidget(self.clear_compare_button)
+        button_layout.addWidget(self.load_progress)
+        button_layout.addWidget(self.cancel_load_button)
 
         self.slice_slider = QSlider(Qt.Horizontal, self)
         self.slice_slider.setMinimum(0)
-        self.slice_slider.valueChanged.connect(self.update_displayed_grid)
+        self.slice_slider.valueChanged.connect(self.on_slider_moved)
         self.slice_slider.setVisible(False)
         button_layout.addWidget(self.slice_slider)
 
@@ -128,7 +1652,7 @@ class DICOMViewer(QWidget):
 
     def update_navigation_buttons(self):
         """Update the state of navigation buttons based on current view"""
-        has_files = len(self.dicom_files) > 0 if self.is_folder_view else False
+        has_files = len(self.dicom_files) > 0 if self.is_folder_view and self.view_mode != 'compare' else False
         self.prev_button.setEnabled(has_files and self.current_file_index > 0)
         self.next_button.setEnabled(
             has_files and self.current_file_index + self.slices_per_grid < len(self.dicom_files))
@@ -136,16 +1660,46 @@ class DICOMViewer(QWidget):
     def clear_all_data(self):
         """Clear all loaded data and reset the viewer state"""
         try:
-            # Stop any ongoing timers
+            # Stop any ongoing timers and background loading
             if self.image_timer.isActive():
                 self.image_timer.stop()
+            self.cancel_folder_loading()
+            self.cancel_prefetch()
+            self.ingest_pending = []
+            self.slice_cache.clear()
+            self.pixmap_cache.clear()
+            self.folder_loader = None
+            self.load_progress.setVisible(False)
+            self.cancel_load_button.setVisible(False)
 
             # Clear the image grid first
             self.clear_image_display()
 
             # Reset all data
             self.dicom_data = None
-            self.dicom_files.clear()
+            self.cine_frames = []
+            self.cine_frame_count = 0
+            if isinstance(self.image_data_3d, EncapsulatedFrames):
+                self.image_data_3d.close()
+            self.single_image_data = None
+            self.voi_lut = None
+            self.display_window = None
+            self.default_window = None
+            self.view_mode = None
+            self.dicom_files = []
+            self.series_index.clear()
+            self.current_series = None
+            if self.comparison:
+                self.restore_grid_layout()
+            self.comparison = []
+            self.comparison_indices = []
+            self.clear_compare_button.setVisible(False)
+            self.series_combo.blockSignals(True)
+            self.series_combo.clear()
+            self.series_combo.blockSignals(False)
+            self.series_combo.setVisible(False)
+            self.volume_button.setVisible(False)
+            self.compare_button.setVisible(False)
             self.current_file_index = 0
             self.image_data_3d = None
 
@@ -166,31 +1720,69 @@ class DICOMViewer(QWidget):
             print(f"Error during cleanup: {e}")
 
     def clear_image_display(self):
-        """Safely clear the image grid"""
-        try:
-            while self.image_grid.count():
-                item = self.image_grid.takeAt(0)
-                widget = item.widget()
-                if widget is not None:  # Check if widget exists
-                    widget.setParent(None)
-                    widget.deleteLater()
+        """Blank the tiles and the single view without destroying any widgets"""
+        for label in self.tile_labels:
+            label.clear()
+        self.video_label.clear()
+        self.video_label.setVisible(False)
+
+    def build_tile_pool(self, rows, cols):
+        """Create the tile labels for a rows x cols layout; done only when the layout changes"""
+        for label in self.tile_labels:
+            self.image_grid.removeWidget(label)
+            label.deleteLater()
+        self.grid_rows, self.grid_cols = rows, cols
+        self.slices_per_grid = rows * cols
+        self.tile_size = self.grid_display_size // max(rows, cols)
+        self.tile_labels = []
+        for i in range(rows * cols):
+            label = QLabel(self)
+            label.setAlignment(Qt.AlignCenter)
+            label.setFixedSize(self.tile_size, self.tile_size)
+            self.image_grid.addWidget(label, i // cols, i % cols)
+            self.tile_labels.append(label)
+        # The single view (one image or cine) covers the whole grid
+        self.image_grid.removeWidget(self.video_label)
+        self.image_grid.addWidget(self.video_label, 0, 0, rows, cols, Qt.AlignCenter)
+
+    def set_grid_layout(self, layout_text):
+        rows, cols = (int(value) for value in layout_text.split('x'))
+        if (rows, cols) == (self.grid_rows, self.grid_cols) or self.view_mode == 'compare':
+            return
+        self.build_tile_pool(rows, cols)
+        if self.view_mode == 'volume' and self.image_data_3d is not None:
+            self.slice_slider.setMaximum(max(0, self.image_data_3d.shape[0] - self.slices_per_grid))
+        if self.view_mode == 'folder':
+            self.current_file_index = min(self.current_file_index,
+                                          max(0, len(self.dicom_files) - self.slices_per_grid))
+        self.refresh_display()
+        self.update_navigation_buttons()
 
-        except Exception as e:
-            print(f"Error clearing image display: {e}")
+    def show_tiles(self, pixmaps):
+        """Put one pixmap (or None for an empty tile) on each tile label"""
+        self.video_label.setVisible(False)
+        for i, label in enumerate(self.tile_labels):
+            pixmap = pixmaps[i] if i < len(pixmaps) else None
+            if pixmap is None:
+                label.clear()
+            else:
+                label.setPixmap(pixmap)
+            label.setVisible(True)
+
+    def show_single_view(self, pixmap):
+        """Show one large image across the grid area, hiding the tiles"""
+        for label in self.tile_labels:
+            label.setVisible(False)
+        self.video_label.setPixmap(pixmap)
+        self.video_label.setVisible(True)
 
     def display_all_tags(self):
         if not self.dicom_data:
             print("No DICOM file loaded.")
             return
 
-        all_tags = ""
-        for elem in self.dicom_data:
-            if elem.keyword == "PixelData":
-                continue
-            if elem.keyword and elem.value:
-                all_tags += f"{elem.tag} - {elem.name}: {elem.value}\n"
-
-
+        all_tags = '\n'.join(f"{elem.tag} - {elem.name}: {elem.value}" for elem in self.dicom_data
+                             if elem.keyword != "PixelData" and elem.keyword and elem.value)
         self.dicom_info_text.setText(all_tags)
 
     def load_dicom_folder(self):
@@ -200,27 +1792,184 @@ class DICOMViewer(QWidget):
 
             folder_path = QFileDialog.getExistingDirectory(self, "Select DICOM Folder")
             if folder_path:
-                # Load all DICOM files from the folder
-                for filename in os.listdir(folder_path):
-                    if filename.endswith('.dcm'):
-                        file_path = os.path.join(folder_path, filename)
-                        try:
-                            dicom_data = pydicom.dcmread(file_path)
-                            self.dicom_files.append(dicom_data)
-                        except Exception as e:
-                            print(f"Error loading {filename}: {e}")
-
-                if self.dicom_files:
-                    self.is_folder_view = True
-                    self.display_folder_images()
-                    print(f"Loaded {len(self.dicom_files)} DICOM files")
-                else:
-                    print("No DICOM files found in the selected folder")
-
-                self.update_navigation_buttons()
+                self.start_folder_loading(folder_path)
         except Exception as e:
             print(f"Error loading folder: {e}")
 
+    def add_dicom_folder(self):
+        """Scan another folder into the series index, keeping the series already loaded"""
+        if not self.is_folder_view:
+            self.load_dicom_folder()
+            return
+        folder_path = QFileDialog.getExistingDirectory(self, "Select DICOM Folder to Add")
+        if folder_path:
+            self.cancel_folder_loading()
+            self.start_folder_loading(folder_path, append=True)
+
+    def start_folder_loading(self, folder_path, append=False):
+        # Scan on a background worker pool; the first page is decoded in the pool as well
+        self.is_folder_view = True
+        self.first_page_shown = append  # Keep showing the current series while another folder arrives
+        self.folder_loader = DicomFolderLoader(folder_path, preload_count=0 if append else self.slices_per_grid,
+                                               catalog_path=self.catalog.database_path if self.catalog else None,
+                                               parent=self)
+        self.folder_loader.batch_loaded.connect(self.on_folder_batch_loaded)
+        self.folder_loader.page_decoded.connect(self.on_first_page_decoded)
+        self.folder_loader.progress.connect(self.on_folder_load_progress)
+        self.folder_loader.finished_loading.connect(self.on_folder_loading_finished)
+        self.folder_load_started = time.perf_counter()
+        self.load_progress.setValue(0)
+        self.load_progress.setVisible(True)
+        self.cancel_load_button.setVisible(True)
+        self.folder_loader.start()
+
+    def toggle_receiving(self, enabled):
+        """Start or stop the local DICOMweb/C-STORE receiver"""
+        if not enabled:
+            if self.ingest_server is not None:
+                self.ingest_server.stop()
+                self.ingest_server = None
+            self.ingest_timer.stop()
+            self.flush_received_instances()
+            return
+        if not self.is_folder_view:
+            self.clear_all_data()
+            self.is_folder_view = True
+            self.first_page_shown = False
+        self.ingest_server = DicomIngestServer(
+            http_port=int(os.environ.get('DICOM_WEB_PORT', 8042)),
+            dimse_port=int(os.environ.get('DICOM_STORE_PORT', 11112)),
+            catalog_path=self.catalog.database_path if self.catalog else None, parent=self)
+        self.ingest_server.instance_received.connect(self.on_instance_received)
+        try:
+            self.ingest_server.start()
+        except OSError as e:
+            print(f"Could not start the receiver: {e}")
+            self.ingest_server = None
+            self.receive_button.setChecked(False)
+            return
+        self.ingest_timer.start(250)
+
+    def on_instance_received(self, record):
+        self.ingest_pending.append(record)
+
+    def flush_received_instances(self):
+        """Add the instances received since the last flush and redraw the current page"""
+        if not self.ingest_pending:
+            return
+        records, self.ingest_pending = self.ingest_pending, []
+        # A resent instance overwrites its file; keep a single record for it
+        records = [record for record in records if record.sop_instance_uid not in self.series_index.instances]
+        if not records:
+            return
+        self.series_index.add(records)
+        if self.current_series is None:
+            self.current_series = self.series_index.series_keys()[0]
+        self.dicom_files = self.series_index.series(*self.current_series)
+        self.refresh_series_list()
+        if self.view_mode == 'compare':
+            return
+        # Pages already shown come from the caches, so redrawing on every batch stays cheap
+        self.first_page_shown = True
+        self.display_folder_images()
+        self.update_navigation_buttons()
+        self.current_slice_label.setText(f"Received {len(self.series_index.instances)} instances")
+
+    def cancel_folder_loading(self):
+        """Stop the background folder scan, keeping the slices loaded so far"""
+        if self.folder_loader is not None and self.folder_loader.isRunning():
+            self.folder_loader.cancel()
+
+    def on_folder_batch_loaded(self, records):
+        if self.sender() is not self.folder_loader:
+            return  # Late batch from a scan that has been replaced
+        self.series_index.add(records)
+        if self.current_series is None:
+            self.current_series = self.series_index.series_keys()[0]
+        self.dicom_files = self.series_index.series(*self.current_series)
+        self.update_navigation_buttons()
+
+    def on_first_page_decoded(self, decoded):
+        """Attach the pre-decoded pixels to the indexed records and show that series' first page"""
+        if self.sender() is not self.folder_loader:
+            return
+        series_key = (decoded[0].study_instance_uid, decoded[0].series_instance_uid)
+        pixels = {record.file_path: record.pixels for record in decoded}
+        for record in self.series_index.series(*series_key):
+            if record.file_path in pixels:
+                record.pixels = pixels[record.file_path]
+        if not self.first_page_shown:
+            self.first_page_shown = True
+            self.current_series = series_key
+            self.dicom_files = self.series_index.series(*series_key)
+            self.display_folder_images()
+
+    def on_folder_load_progress(self, done, total):
+        if self.sender() is not self.folder_loader:
+            return
+        self.load_progress.setMaximum(max(total, 1))
+        self.load_progress.setValue(done)
+
+    def on_folder_loading_finished(self, cancelled):
+        if self.sender() is not self.folder_loader:
+            return
+        self.load_progress.setVisible(False)
+        self.cancel_load_button.setVisible(False)
+
+        PERF.record('load_dicom_folder', (time.perf_counter() - self.folder_load_started) * 1000.0,
+                    files=len(self.series_index.instances), cancelled=cancelled)
+        if self.dicom_files:
+            self.refresh_series_list()
+            if self.view_mode != 'compare':
+                self.display_folder_images()
+            status = "Cancelled after" if cancelled else "Loaded"
+            print(f"{status} {len(self.series_index.instances)} DICOM files "
+                  f"in {self.series_combo.count()} series")
+        else:
+            self.is_folder_view = False
+            print("No DICOM files found in the selected folder")
+
+        self.update_navigation_buttons()
+
+    def refresh_series_list(self):
+        """Fill the series selector from the index, keeping the current selection"""
+        self.series_combo.blockSignals(True)
+        self.series_combo.clear()
+        for key in self.series_index.series_keys():
+            self.series_combo.addItem(self.series_index.describe_series(*key), key)
+            if key == self.current_series:
+                self.series_combo.setCurrentIndex(self.series_combo.count() - 1)
+        self.series_combo.blockSignals(False)
+        self.series_combo.setVisible(self.series_combo.count() > 1)
+        self.volume_button.setVisible(self.series_combo.count() > 0)
+        self.compare_button.setVisible(self.series_combo.count() > 0)
+
+    def select_series(self, combo_index):
+        key = self.series_combo.itemData(combo_index)
+        if key is None:
+            return
+        self.current_series = tuple(key)
+        self.dicom_files = self.series_index.series(*self.current_series)
+        if self.view_mode == 'compare':
+            return  # The selection picks the next series to add to the comparison
+        self.current_file_index = 0
+        self.display_window = None
+        self.display_folder_images()
+
+    def open_series_volume(self):
+        """Stack the selected series into a 3D volume for slider browsing and cine"""
+        if self.current_series is None:
+            return
+        try:
+            volume = self.series_index.build_volume(*self.current_series)
+        except Exception as e:
+            print(f"Error building series volume: {e}")
+            return
+        if volume is not None:
+            first_record = self.dicom_files[0]
+            self.volume_transform = first_record.transform
+            self.display_tiles(volume, first_record.window)
+
     def show_previous_page(self):
         if self.dicom_files:
             self.current_file_index = max(0, self.current_file_index - self.slices_per_grid)
@@ -235,36 +1984,31 @@ class DICOMViewer(QWidget):
     def display_folder_images(self):
         if not self.dicom_files:
             return
+        with PERF.stage('display_folder_images'):
+            self.draw_folder_page()
 
-        self.clear_image_display()
-        rows = cols = int(np.sqrt(self.slices_per_grid))
+    def draw_folder_page(self):
+        if self.view_mode != 'folder' or self.display_window is None:
+            self.view_mode = 'folder'
+            self.reset_display_window(self.folder_default_window())
 
+        pixmaps = []
         for i in range(self.slices_per_grid):
             file_index = self.current_file_index + i
+            pixmap = None
             if file_index < len(self.dicom_files):
-                dicom_data = self.dicom_files[file_index]
-                if 'PixelData' in dicom_data:
-                    image_data = dicom_data.pixel_array
-
-                    # Handle different image types
-                    if len(image_data.shape) > 2:
-                        if len(image_data.shape) == 3 and image_data.shape[2] <= 4:
-                            image_data = image_data[:, :, 0]
-                        else:
-                            image_data = image_data[0] if len(image_data.shape) > 2 else image_data
-
-                    # Normalize and convert to uint8
-                    if image_data.dtype != np.uint8:
-                        image_data = ((image_data - image_data.min()) /
-                                      (image_data.max() - image_data.min()) * 255).astype(np.uint8)
-
-                    # Create QImage and display
-                    qimage = QImage(image_data.data, image_data.shape[1], image_data.shape[0],
-                                    image_data.shape[1], QImage.Format_Grayscale8)
-                    label = QLabel(self)
-                    pixmap = QPixmap.fromImage(qimage)
-                    label.setPixmap(pixmap.scaled(400, 400, Qt.KeepAspectRatio))
-                    self.image_grid.addWidget(label, i // cols, i % cols)
+                record = self.dicom_files[file_index]
+                if record.has_pixels:
+                    # Decode only the slices shown on this page, reusing cached renders
+                    try:
+                        pixmap = self.get_tile_pixmap(self.record_slice_key(record, self.display_window),
+                                                      lambda: self.render_record_slice(record))
+                    except Exception as e:
+                        print(f"Error decoding {record.file_path}: {e}")
+            pixmaps.append(pixmap)
+        self.show_tiles(pixmaps)
+
+        self.prefetch_folder_pages()
 
         # Update navigation buttons
         self.prev_button.setEnabled(self.current_file_index > 0)
@@ -277,74 +2021,68 @@ class DICOMViewer(QWidget):
 
             dicom_file, _ = QFileDialog.getOpenFileName(self, "Open DICOM File", "", "DICOM Files (*.dcm)")
             if dicom_file:
-                self.dicom_data = pydicom.dcmread(dicom_file)
-                self.display_patient_info()
-                self.display_image()
-                self.update_navigation_buttons()
+                with PERF.stage('load_dicom'):
+                    # Large elements stay on disk until used, so PixelData can be memory-mapped
+                    with PERF.stage('dcmread'):
+                        self.dicom_data = pydicom.dcmread(dicom_file, defer_size='4 MB')
+                    if self.catalog is not None:
+                        record = DicomFileRecord(dicom_file, self.dicom_data)
+                        self.catalog.store([catalog_entry(dicom_file, self.dicom_data, record)])
+                    self.display_patient_info()
+                    self.display_image()
+                    self.update_navigation_buttons()
         except Exception as e:
             print(f"Error loading file: {e}")
 
+    def format_tags(self, fields):
+        """Format (keyword, label) pairs present in the loaded dataset, one per line"""
+        return '\n'.join(f"{label}: {self.dicom_data.data_element(keyword).value}"
+                         for keyword, label in fields if keyword in self.dicom_data)
+
     def display_patient_info(self):
         if not self.dicom_data:
             return
 
         # Extract patient-related info
-        patient_info = ""
-        if 'PatientName' in self.dicom_data:
-            patient_info += f"Patient Name: {self.dicom_data.PatientName}\n"
-        if 'PatientID' in self.dicom_data:
-            patient_info += f"Patient ID: {self.dicom_data.PatientID}\n"
-        if 'PatientBirthDate' in self.dicom_data:
-            patient_info += f"Patient Birth Date: {self.dicom_data.PatientBirthDate}\n"
-        if 'PatientSex' in self.dicom_data:
-            patient_info += f"Patient Sex: {self.dicom_data.PatientSex}\n"
-
-        self.dicom_info_text.setText(patient_info)
+        self.dicom_info_text.setText(self.format_tags([
+            ('PatientName', "Patient Name"),
+            ('PatientID', "Patient ID"),
+            ('PatientBirthDate', "Patient Birth Date"),
+            ('PatientSex', "Patient Sex"),
+        ]))
 
     def display_study_info(self):
         if not self.dicom_data:
             return
 
         # Extract study-related info
-        study_info = ""
-        if 'StudyInstanceUID' in self.dicom_data:
-            study_info += f"Study Instance UID: {self.dicom_data.StudyInstanceUID}\n"
-        if 'StudyDate' in self.dicom_data:
-            study_info += f"Study Date: {self.dicom_data.StudyDate}\n"
-        if 'StudyTime' in self.dicom_data:
-            study_info += f"Study Time: {self.dicom_data.StudyTime}\n"
-        if 'AccessionNumber' in self.dicom_data:
-            study_info += f"Accession Number: {self.dicom_data.AccessionNumber}\n"
-
-        self.dicom_info_text.setText(study_info)
+        self.dicom_info_text.setText(self.format_tags([
+            ('StudyInstanceUID', "Study Instance UID"),
+            ('StudyDate', "Study Date"),
+            ('StudyTime', "Study Time"),
+            ('AccessionNumber', "Accession Number"),
+        ]))
 
     def display_modality_info(self):
         if not self.dicom_data:
             return
 
         # Extract modality-related info
-        modality_info = ""
-        if 'Modality' in self.dicom_data:
-            modality_info += f"Modality: {self.dicom_data.Modality}\n"
-        if 'Manufacturer' in self.dicom_data:
-            modality_info += f"Manufacturer: {self.dicom_data.Manufacturer}\n"
-        if 'InstitutionName' in self.dicom_data:
-            modality_info += f"Institution Name: {self.dicom_data.InstitutionName}\n"
-
-        self.dicom_info_text.setText(modality_info)
+        self.dicom_info_text.setText(self.format_tags([
+            ('Modality', "Modality"),
+            ('Manufacturer', "Manufacturer"),
+            ('InstitutionName', "Institution Name"),
+        ]))
 
     def display_physician_info(self):
         if not self.dicom_data:
             return
 
         # Extract physician-related info
-        physician_info = ""
-        if 'ReferringPhysicianName' in self.dicom_data:
-            physician_info += f"Referring Physician: {self.dicom_data.ReferringPhysicianName}\n"
-        if 'PhysicianOfRecord' in self.dicom_data:
-            physician_info += f"Physician of Record: {self.dicom_data.PhysicianOfRecord}\n"
-
-        self.dicom_info_text.setText(physician_info)
+        self.dicom_info_text.setText(self.format_tags([
+            ('ReferringPhysicianName', "Referring Physician"),
+            ('PhysicianOfRecord', "Physician of Record"),
+        ]))
 
     def display_image_info(self):
         if not self.dicom_data or 'PixelData' not in self.dicom_data:
@@ -352,57 +2090,74 @@ class DICOMViewer(QWidget):
             return
 
         # Extract image-related info
-        image_info = ""
-        if 'Rows' in self.dicom_data:
-            image_info += f"Rows: {self.dicom_data.Rows}\n"
-        if 'Columns' in self.dicom_data:
-            image_info += f"Columns: {self.dicom_data.Columns}\n"
-        if 'BitsAllocated' in self.dicom_data:
-            image_info += f"Bits Allocated: {self.dicom_data.BitsAllocated}\n"
-        if 'PhotometricInterpretation' in self.dicom_data:
-            image_info += f"Photometric Interpretation: {self.dicom_data.PhotometricInterpretation}\n"
-
-        self.dicom_info_text.setText(image_info)
+        self.dicom_info_text.setText(self.format_tags([
+            ('Rows', "Rows"),
+            ('Columns', "Columns"),
+            ('BitsAllocated', "Bits Allocated"),
+            ('PhotometricInterpretation', "Photometric Interpretation"),
+        ]))
 
     def display_image(self):
         if not self.dicom_data or 'PixelData' not in self.dicom_data:
             return
 
-        image_data = self.dicom_data.pixel_array
+        image_data = None
+        if int(self.dicom_data.get('NumberOfFrames') or 1) > 1:
+            image_data = memory_map_frames(self.dicom_data.filename, self.dicom_data)
+            if image_data is None:
+                image_data = open_encapsulated_frames(self.dicom_data.filename, self.dicom_data)
+                if image_data is not None and int(self.dicom_data.get('SamplesPerPixel') or 1) > 1:
+                    # Decoded color frames are reduced to one channel, so play them like other color loops
+                    self.volume_transform = pixel_transform(self.dicom_data)
+                    self.voi_lut = None
+                    self.image_data_3d = image_data
+                    self.reset_display_window(header_window(self.dicom_data) or self.sample_window(image_data))
+                    self.play_video(image_data)
+                    return
+        if image_data is None:
+            image_data = self.dicom_data.pixel_array
+        self.volume_transform = pixel_transform(self.dicom_data)
+        default_window = header_window(self.dicom_data)
+        self.voi_lut = None
+        if default_window is None and 'VOILUTSequence' in self.dicom_data and image_data.dtype.itemsize <= 2:
+            self.voi_lut = voi_lut_table(self.dicom_data, image_data.dtype.newbyteorder('='))
+            default_window = VOI_LUT_WINDOW
 
         if len(image_data.shape) == 4:  # Multi-frame (time series) with potential color data
             self.image_data_3d = image_data[:, :, :, 0] if image_data.shape[3] <= 4 else image_data[:, :, :, 0]
+            self.reset_display_window(default_window or self.sample_window(self.image_data_3d))
             self.play_video(self.image_data_3d)
         elif len(image_data.shape) == 3:
             if image_data.shape[2] <= 4:  # 3D Color image
-                self.display_single_image(image_data[:, :, 0])
+                self.display_single_image(image_data[:, :, 0], default_window)
             else:  # Multi-frame grayscale
                 self.image_data_3d = image_data
-                self.display_tiles(image_data)
+                self.display_tiles(image_data, default_window)
         else:  # 2D grayscale
-            self.display_single_image(image_data)
+            self.display_single_image(image_data, default_window)
 
-    def display_single_image(self, image_data):
-        if image_data.dtype != np.uint8:
-            image_data = ((image_data - image_data.min()) /
-                          (image_data.max() - image_data.min()) * 255).astype(np.uint8)
+    def display_single_image(self, image_data, default_window=None):
+        if self.view_mode != 'single' or self.single_image_data is not image_data:
+            self.view_mode = 'single'
+            self.single_image_data = image_data
+            self.reset_display_window(default_window or auto_window([image_data], self.volume_transform))
 
+        image_data = self.render_pixels(image_data, self.volume_transform, self.display_window)
         height, width = image_data.shape
         qimage = QImage(image_data.data, width, height, width, QImage.Format_Grayscale8)
 
-        label = QLabel(self)
         pixmap = QPixmap.fromImage(qimage)
-        label.setPixmap(pixmap.scaled(400, 400, Qt.KeepAspectRatio))
+        self.show_single_view(pixmap.scaled(400, 400, Qt.KeepAspectRatio))
 
-        self.clear_image_display()
-        self.image_grid.addWidget(label, 0, 0)
-
-    def display_tiles(self, image_data):
+    def display_tiles(self, image_data, default_window=None):
         if len(image_data.shape) != 3:
             return
 
         num_slices = image_data.shape[0]
         self.image_data_3d = image_data
+        self.volume_id += 1
+        self.view_mode = 'volume'
+        self.reset_display_window(default_window or self.sample_window(image_data))
 
         max_start_index = max(0, num_slices - self.slices_per_grid)
         self.slice_slider.setMaximum(max_start_index)
@@ -415,35 +2170,177 @@ class DICOMViewer(QWidget):
     def update_displayed_grid(self, start_slice_idx):
         if self.image_data_3d is None:
             return
+        with PERF.stage('update_displayed_grid'):
+            self.draw_volume_page(start_slice_idx)
 
-        image_data = self.image_data_3d
-        num_slices = image_data.shape[0]
-        rows = 2
-        cols = 2 if num_slices > 1 else 1
-        self.slices_per_grid = rows * cols
-
-        self.clear_image_display()
+    def draw_volume_page(self, start_slice_idx):
+        num_slices = self.image_data_3d.shape[0]
+        self.view_mode = 'volume'
 
         end_slice_idx = min(start_slice_idx + self.slices_per_grid, num_slices)
         self.current_slice_label.setText(f"Slice Range: {start_slice_idx} to {end_slice_idx - 1}")
 
-        slice_idx = start_slice_idx
-        for r in range(rows):
-            for c in range(cols):
-                if slice_idx < end_slice_idx:
-                    slice_data = image_data[slice_idx]
-                    if slice_data.dtype != np.uint8:
-                        slice_data = ((slice_data - slice_data.min()) /
-                                      (slice_data.max() - slice_data.min()) * 255).astype(np.uint8)
+        # Neighbouring slider positions share all but one slice, so most tiles come from the cache
+        self.show_tiles([self.get_tile_pixmap(self.volume_slice_key(slice_idx, self.display_window),
+                                              lambda index=slice_idx: self.render_volume_slice(index))
+                         for slice_idx in range(start_slice_idx, end_slice_idx)])
+
+        self.prefetch_volume_pages(start_slice_idx)
+
+    def record_slice_key(self, record, window):
+        return record.file_path, 0, window
+
+    def volume_slice_key(self, slice_idx, window):
+        return 'volume', self.volume_id, slice_idx, window
+
+    def render_pixels(self, pixels, transform, window):
+        """Window stored pixel values into an 8-bit display slice"""
+        with PERF.stage('normalize'):
+            if window == VOI_LUT_WINDOW:
+                return apply_lut(pixels, self.voi_lut)
+            return apply_window(pixels, transform, window)
+
+    def render_record_slice(self, record, window=None):
+        image_data = record.read_image()
+        if image_data is None:
+            return None
+        return self.render_pixels(image_data, record.transform, window or self.display_window)
+
+    def render_volume_slice(self, slice_idx, volume=None, window=None):
+        volume = self.image_data_3d if volume is None else volume
+        return self.render_pixels(volume[slice_idx], self.volume_transform, window or self.display_window)
+
+    def sample_window(self, volume, max_samples=16):
+        """Auto window from evenly spaced frames, touching only those frames"""
+        num_slices = volume.shape[0]
+        indices = np.unique(np.linspace(0, num_slices - 1, min(num_slices, max_samples)).astype(int))
+        return auto_window([volume[index] for index in indices], self.volume_transform)
+
+    def folder_default_window(self):
+        return series_default_window(self.dicom_files)
+
+    def reset_display_window(self, default_window):
+        """Use a new source's default window and show it in the controls"""
+        self.default_window = default_window
+        self.display_window = default_window
+        self.window_preset_combo.setCurrentIndex(0)
+        self.update_window_inputs()
+
+    def update_window_inputs(self):
+        uses_window = self.display_window not in (None, VOI_LUT_WINDOW)
+        for spin_box, value in ((self.window_center_input, 0), (self.window_width_input, 1)):
+            spin_box.blockSignals(True)
+            if uses_window:
+                spin_box.setValue(int(round(self.display_window[value])))
+            spin_box.setEnabled(self.display_window is not None)
+            spin_box.blockSignals(False)
+
+    def apply_window_preset(self, preset):
+        if self.display_window is None:
+            return
+        if preset == "Default":
+            self.display_window = self.default_window
+        elif preset == "Auto (Min/Max)":
+            if self.view_mode == 'folder':
+                record = next((record for record in self.dicom_files if record.has_pixels), None)
+                image_data = record.read_image() if record else None
+                if image_data is None:
+                    return
+                self.display_window = auto_window([image_data], record.transform)
+            elif self.view_mode == 'single':
+                self.display_window = auto_window([self.single_image_data], self.volume_transform)
+            elif self.view_mode == 'compare':
+                record = self.comparison[0].records[self.comparison_indices[0]]
+                self.display_window = auto_window([record.read_image()], record.transform)
+            else:
+                self.display_window = self.sample_window(self.image_data_3d)
+        else:
+            self.display_window = tuple(float(value) for value in CT_WINDOW_PRESETS[preset])
+        self.update_window_inputs()
+        self.refresh_display()
 
-                    qimage = QImage(slice_data.data, slice_data.shape[1], slice_data.shape[0],
-                                    slice_data.shape[1], QImage.Format_Grayscale8)
+    def on_window_input_changed(self, _):
+        if self.display_window is None:
+            return
+        self.display_window = (float(self.window_center_input.value()), float(self.window_width_input.value()))
+        self.refresh_display()
 
-                    label = QLabel(self)
-                    pixmap = QPixmap.fromImage(qimage)
-                    label.setPixmap(pixmap.scaled(400, 400, Qt.KeepAspectRatio))
-                    self.image_grid.addWidget(label, r, c)
-                    slice_idx += 1
+    def refresh_display(self):
+        """Redraw the current view after a window/level change"""
+        if self.image_timer.isActive():
+            self.play_video()
+        elif self.view_mode == 'volume':
+            self.update_displayed_grid(self.slice_slider.value())
+        elif self.view_mode == 'single':
+            self.display_single_image(self.single_image_data)
+        elif self.view_mode == 'folder':
+            self.display_folder_images()
+        elif self.view_mode == 'compare':
+            self.display_comparison()
+
+    def get_rendered_slice(self, key, render):
+        """Return the 8-bit slice for a cache key, rendering and caching it on a miss"""
+        image_data = self.slice_cache.get(key)
+        if image_data is None:
+            image_data = render()
+            if image_data is not None:
+                self.slice_cache.put(key, image_data, image_data.nbytes)
+        return image_data
+
+    def get_tile_pixmap(self, key, render, size=None):
+        """Return the scaled tile pixmap for a cache key, building it from the 8-bit slice on a miss"""
+        size = size or self.tile_size
+        pixmap_key = key + (size,)
+        pixmap = self.pixmap_cache.get(pixmap_key)
+        if pixmap is not None:
+            return pixmap
+
+        image_data = self.get_rendered_slice(key, render)
+        if image_data is None:
+            return None
+        with PERF.stage('qpixmap'):
+            qimage = QImage(image_data.data, image_data.shape[1], image_data.shape[0],
+                            image_data.shape[1], QImage.Format_Grayscale8)
+            pixmap = QPixmap.fromImage(qimage).scaled(size, size, Qt.KeepAspectRatio)
+        self.pixmap_cache.put(pixmap_key, pixmap, pixmap.width() * pixmap.height() * 4)
+        return pixmap
+
+    def cancel_prefetch(self):
+        """Drop queued prefetch work that has not started yet"""
+        for future in self.prefetch_futures:
+            future.cancel()
+        self.prefetch_futures = []
+
+    def queue_prefetch(self, jobs):
+        """Render (key, render) jobs on the prefetch pool, replacing any older queued jobs"""
+        self.cancel_prefetch()
+        for key, render in jobs:
+            if key not in self.slice_cache:
+                self.prefetch_futures.append(self.prefetch_pool.submit(self.get_rendered_slice, key, render))
+
+    def prefetch_folder_pages(self):
+        """Decode the next and previous folder pages in the background"""
+        page_size = self.slices_per_grid
+        indices = list(range(self.current_file_index + page_size, self.current_file_index + 2 * page_size))
+        indices += list(range(max(0, self.current_file_index - page_size), self.current_file_index))
+        records = [self.dicom_files[i] for i in indices if i < len(self.dicom_files)]
+        window = self.display_window
+        self.queue_prefetch((self.record_slice_key(record, window),
+                             lambda record=record: self.render_record_slice(record, window))
+                            for record in records if record.has_pixels)
+
+    def prefetch_volume_pages(self, start_slice_idx):
+        """Render the grids on either side of the slider position in the background"""
+        num_slices = self.image_data_3d.shape[0]
+        page_size = self.slices_per_grid
+        indices = list(range(start_slice_idx + page_size, min(start_slice_idx + 2 * page_size, num_slices)))
+        indices += list(range(max(0, start_slice_idx - page_size), start_slice_idx))
+        volume, window = self.image_data_3d, self.display_window
+        if isinstance(volume, EncapsulatedFrames):
+            volume.prefetch(indices)
+        self.queue_prefetch((self.volume_slice_key(index, window),
+                             lambda index=index: self.render_volume_slice(index, volume, window))
+                            for index in indices)
 
     def play_video(self, _=None):
         """Starts playing video from the 3D array of frames."""
@@ -451,57 +2348,220 @@ class DICOMViewer(QWidget):
             print("No valid video frames loaded.")
             return
 
-        # Reset current frame if playing again
-        self.current_video_frame = 0
-
         # Stop timer if it is already running
         if self.image_timer.isActive():
             self.image_timer.stop()
 
-        # Normalize pixel values for consistent display
-        video_frames = self.image_data_3d
-        if video_frames.dtype != np.uint8:
-            video_frames = ((video_frames - video_frames.min()) /
-                            (video_frames.max() - video_frames.min()) * 255).astype(np.uint8)
+        # Prepare display-ready frames once instead of on every tick
+        if self.display_window is None:
+            self.reset_display_window(self.sample_window(self.image_data_3d))
+        window = self.display_window
+        self.cine_frame_count = self.image_data_3d.shape[0]
+        # Memory-mapped, compressed or very long loops are rendered per frame through the slice caches
+        self.cine_lazy = isinstance(self.image_data_3d, (np.memmap, SignExtendedFrames, EncapsulatedFrames)) or \
+            self.cine_frame_count * self.cine_size * self.cine_size > CINE_BUFFER_BYTES
+        if self.cine_lazy:
+            self.cine_frames = []
+        else:
+            self.cine_frames = build_cine_frames(
+                self.image_data_3d, self.cine_size,
+                lambda frame_data: self.render_pixels(frame_data, self.volume_transform, window))
+        self.cine_interval_ms = cine_frame_interval_ms(None if self.is_folder_view else self.dicom_data)
+
+        # Reuse a single label for the whole playback
+        self.clear_image_display()
 
-        self.image_data_3d = video_frames  # Update data for playback
-        self.image_timer.start(100)  # Set frame rate (milliseconds)
+        # Reset current frame if playing again
+        self.current_video_frame = 0
+        self.cine_frames_shown = 0
+        self.cine_frames_dropped = 0
+        self.cine_clock.start()
+        self.show_cine_frame(0)
+        # Tick faster than the frame rate; the clock decides which frame is due
+        self.image_timer.start(max(1, int(self.cine_interval_ms / 2)))
 
     def stop_video(self):
         """Stop the video playback."""
         if self.image_timer.isActive():
             self.image_timer.stop()
 
+    def show_cine_frame(self, frame_index):
+        if self.cine_lazy:
+            pixmap = self.get_tile_pixmap(self.volume_slice_key(frame_index, self.display_window),
+                                          lambda: self.render_volume_slice(frame_index), self.cine_size)
+            self.prefetch_cine_frames(frame_index)
+        else:
+            pixmap = QPixmap.fromImage(self.cine_frames[frame_index])
+        self.show_single_view(pixmap)
+        self.current_video_frame = frame_index
+        self.cine_frames_shown += 1
+
+    def prefetch_cine_frames(self, frame_index, frames_ahead=8):
+        """Render the frames just after the cine cursor in the background"""
+        volume, window = self.image_data_3d, self.display_window
+        if isinstance(volume, EncapsulatedFrames):
+            # Keep the decoder pool busy further ahead than the render prefetch
+            decode_ahead = 2 * (os.cpu_count() or 1) + frames_ahead
+            volume.prefetch((frame_index + offset) % self.cine_frame_count for offset in range(1, decode_ahead + 1))
+        indices = [(frame_index + offset) % self.cine_frame_count for offset in range(1, frames_ahead + 1)]
+        self.queue_prefetch((self.volume_slice_key(index, window),
+                             lambda index=index: self.render_volume_slice(index, volume, window))
+                            for index in indices)
+
     def update_video_frame(self):
-        """Update the video frame for playback."""
-        if self.image_data_3d is None:
+        """Show the frame that is due now, dropping any frames that were missed."""
+        if not self.cine_frame_count:
             return
 
-        num_frames = self.image_data_3d.shape[0]
-
-        # Check if all frames have been displayed
-        if self.current_video_frame >= num_frames:
-            self.stop_video()  # Stop the video once all frames are shown
+        num_frames = self.cine_frame_count
+        elapsed_ms = self.cine_clock.elapsed()
+        due_frame = int(elapsed_ms / self.cine_interval_ms)
+        shown_frame = self.cine_frames_shown + self.cine_frames_dropped - 1
+        if due_frame <= shown_frame:
             return
 
-        frame_data = self.image_data_3d[self.current_video_frame]
+        # Keep wall-clock speed when rendering falls behind
+        self.cine_frames_dropped += due_frame - shown_frame - 1
+        with PERF.stage('update_video_frame'):
+            self.show_cine_frame(due_frame % num_frames)
+
+        if elapsed_ms > 0:
+            self.cine_achieved_fps = self.cine_frames_shown * 1000.0 / elapsed_ms
+            self.current_slice_label.setText(
+                f"Frame {self.current_video_frame + 1}/{num_frames} - "
+                f"{self.cine_achieved_fps:.1f} fps (target {1000.0 / self.cine_interval_ms:.1f}), "
+                f"dropped {self.cine_frames_dropped}")
+
+    def on_slider_moved(self, value):
+        if self.view_mode == 'compare':
+            self.scroll_comparison(0, value)
+        else:
+            self.update_displayed_grid(value)
 
-        if frame_data.dtype != np.uint8:
-            frame_data = ((frame_data - frame_data.min()) /
-                          (frame_data.max() - frame_data.min()) * 255).astype(np.uint8)
+    def add_series_to_comparison(self):
+        """Show the selected series next to the ones already being compared"""
+        if self.current_series is None or any(pane.key == self.current_series for pane in self.comparison):
+            return
+        pane = ComparisonSeries(self.current_series, self.series_index.series(*self.current_series))
+        if not len(pane):
+            return
+        if self.image_timer.isActive():
+            self.image_timer.stop()
+        if not self.comparison:
+            # Every pane uses the first series' window so prior and current have the same contrast
+            self.view_mode = 'compare'
+            self.reset_display_window(series_default_window(pane.records))
+            self.comparison_indices = [len(pane) // 2]
+        else:
+            reference = self.comparison[0]
+            self.comparison_indices.append(pane.matching_slice(reference, self.comparison_indices[0]))
+        self.comparison.append(pane)
+
+        count = len(self.comparison)
+        rows = 2 if count > 3 else 1
+        self.build_tile_pool(rows, (count + rows - 1) // rows)
+        self.clear_compare_button.setVisible(True)
+        self.slice_slider.blockSignals(True)
+        self.slice_slider.setMaximum(len(self.comparison[0]) - 1)
+        self.slice_slider.setSingleStep(1)
+        self.slice_slider.setValue(self.comparison_indices[0])
+        self.slice_slider.blockSignals(False)
+        self.slice_slider.setVisible(True)
+        self.display_comparison()
+        self.update_navigation_buttons()
 
-        qimage = QImage(frame_data.data, frame_data.shape[1], frame_data.shape[0],
-                        frame_data.shape[1], QImage.Format_Grayscale8)
-        pixmap = QPixmap.fromImage(qimage)
+    def close_comparison(self):
+        self.comparison = []
+        self.comparison_indices = []
+        self.clear_compare_button.setVisible(False)
+        self.slice_slider.setVisible(False)
+        self.restore_grid_layout()
+        self.view_mode = None
+        self.display_window = None
+        self.display_folder_images()
+        self.update_navigation_buttons()
 
-        # Clear current grid and display the frame
-        self.clear_image_display()
-        label = QLabel(self)
-        label.setPixmap(pixmap.scaled(800, 800, Qt.KeepAspectRatio))
-        self.image_grid.addWidget(label, 0, 0)
+    def restore_grid_layout(self):
+        """Go back to the grid chosen in the layout selector after the comparison panes"""
+        self.build_tile_pool(*(int(value) for value in self.grid_layout_combo.currentText().split('x')))
 
-        # Increment frame counter
-        self.current_video_frame = (self.current_video_frame + 1) % num_frames
+    def scroll_comparison(self, pane_index, slice_index):
+        """Move one pane to slice_index and every other pane to the slice at the same patient position"""
+        if not self.comparison:
+            return
+        reference = self.comparison[pane_index]
+        slice_index = max(0, min(slice_index, len(reference) - 1))
+        self.comparison_indices = [pane.matching_slice(reference, slice_index) for pane in self.comparison]
+        if pane_index != 0 and self.comparison_indices[0] is not None:
+            self.slice_slider.blockSignals(True)
+            self.slice_slider.setValue(self.comparison_indices[0])
+            self.slice_slider.blockSignals(False)
+        self.display_comparison()
+
+    def display_comparison(self):
+        window = self.display_window
+        pixmaps, positions = [], []
+        for pane, slice_index in zip(self.comparison, self.comparison_indices):
+            if slice_index is None:
+                pixmaps.append(None)
+                positions.append(f"#{pane.records[0].series_number}: -")
+                continue
+            record = pane.records[slice_index]
+            pixmaps.append(self.get_tile_pixmap(self.record_slice_key(record, window),
+                                                lambda record=record: self.render_record_slice(record, window)))
+            positions.append(f"#{record.series_number}: {slice_index + 1}/{len(pane)}")
+        self.show_tiles(pixmaps)
+        self.current_slice_label.setText("Slices " + ", ".join(positions))
+        self.prefetch_comparison_slices()
+
+    def prefetch_comparison_slices(self, slices_ahead=2):
+        """Decode the neighbouring slices of every pane in the background"""
+        window = self.display_window
+        records = []
+        for offset in range(1, slices_ahead + 1):
+            for pane, slice_index in zip(self.comparison, self.comparison_indices):
+                if slice_index is None:
+                    continue
+                records += [pane.records[i] for i in (slice_index + offset, slice_index - offset) if 0 <= i < len(pane)]
+        self.queue_prefetch((self.record_slice_key(record, window),
+                             lambda record=record: self.render_record_slice(record, window))
+                            for record in records)
+
+    def wheelEvent(self, event):
+        """Scroll the comparison pane under the mouse; the other panes follow"""
+        if self.view_mode != 'compare':
+            super().wheelEvent(event)
+            return
+        for pane_index, label in enumerate(self.tile_labels[:len(self.comparison)]):
+            if label.geometry().contains(event.pos()) and self.comparison_indices[pane_index] is not None:
+                step = -1 if event.angleDelta().y() > 0 else 1
+                self.scroll_comparison(pane_index, self.comparison_indices[pane_index] + step)
+                event.accept()
+                return
+        super().wheelEvent(event)
+
+    def toggle_debug_overlay(self, enabled):
+        self.debug_overlay.setVisible(enabled)
+        if enabled:
+            self.update_debug_overlay()
+            self.debug_overlay_timer.start(500)
+        else:
+            self.debug_overlay_timer.stop()
+
+    def update_debug_overlay(self):
+        """Show live fps, cache and per-stage timings over the image area"""
+        lines = [f"cine fps: {self.cine_achieved_fps:.1f}" if self.image_timer.isActive() else "cine: stopped"]
+        for name, cache in (('slices', self.slice_cache), ('pixmaps', self.pixmap_cache)):
+            lookups = cache.hits + cache.misses
+            hit_rate = 100.0 * cache.hits / lookups if lookups else 0.0
+            lines.append(f"{name} cache: {cache.hits} hits / {cache.misses} misses ({hit_rate:.0f}%), "
+                         f"{cache.current_bytes / 1e6:.0f} MB")
+        for name, count, average_ms, last_ms in PERF.summary():
+            lines.append(f"{name}: last {last_ms:.1f} ms, avg {average_ms:.1f} ms (n={count})")
+        self.debug_overlay.setText('\n'.join(lines))
+        self.debug_overlay.adjustSize()
+        self.debug_overlay.move(self.image_grid.geometry().topLeft())
+        self.debug_overlay.raise_()
 
     def anonymize_dicom(self):
         if not self.dicom_data:
@@ -513,10 +2573,11 @@ class DICOMViewer(QWidget):
             print("Please enter a prefix for anonymization.")
             return
 
-        # Anonymize critical tags
-        for tag in ['PatientName', 'PatientID', 'PhysicianName']:
-            if tag in self.dicom_data:
-                self.dicom_data.data_element(tag).value = anonymize_tag(self.dicom_data.data_element(tag).value, prefix)
+        # Anonymize identifying tags with the same pseudonyms the batch mode produces
+        if not self.anonymization_secret:
+            self.anonymization_secret = secrets.token_hex(32)
+            print("DICOM_ANON_SECRET is not set; using a random key, so pseudonyms only match within this session")
+        anonymize_dataset(self.dicom_data, prefix, self.anonymization_secret)
 
         # Update the displayed tags after anonymization
         self.display_patient_info()
@@ -532,27 +2593,191 @@ class DICOMViewer(QWidget):
 
     def search_tags(self):
         """Search for tags containing the entered keyword."""
-        if not self.dicom_data:
-            print("No DICOM file loaded.")
-            return
-
         keyword = self.search_input.text().strip().lower()
         if not keyword:
             self.dicom_info_text.setText("Please enter a keyword to search.")
             return
 
-        matching_tags = ""
-        for elem in self.dicom_data:
-            if elem.keyword and keyword in elem.keyword.lower():
-                matching_tags += f"{elem.tag} - {elem.name}: {elem.value}\n"
-
-        if matching_tags:
-            self.dicom_info_text.setText(matching_tags)
+        # Tags of the loaded file, then matching files from the catalog of scanned folders
+        sections = []
+        if self.dicom_data:
+            matching_tags = [f"{elem.tag} - {elem.name}: {elem.value}" for elem in self.dicom_data
+                             if elem.keyword and elem.keyword != 'PixelData' and keyword in elem.keyword.lower()]
+            if matching_tags:
+                sections.append('\n'.join(matching_tags))
+        if self.catalog is not None:
+            try:
+                matches = self.catalog.search(self.search_input.text().strip())
+            except Exception as e:
+                print(f"Error searching DICOM catalog: {e}")
+                matches = []
+            if matches:
+                lines = [f"Catalog matches ({len(matches)}):"]
+                lines += [f"{match['path']} - {match['patient_name']} {match['modality']} "
+                          f"{match['study_date']} {match['series_description']}" for match in matches]
+                sections.append('\n'.join(lines))
+
+        if sections:
+            self.dicom_info_text.setText('\n\n'.join(sections))
         else:
             self.dicom_info_text.setText("No matching tags found.")
 
-if __name__ == "__main__":
+
+def qimage_to_array(qimage):
+    """Copy a Grayscale8 QImage into a (height, width) uint8 array, dropping row padding"""
+    bits = qimage.constBits()
+    bits.setsize(qimage.bytesPerLine() * qimage.height())
+    rows = np.frombuffer(bits, dtype=np.uint8).reshape(qimage.height(), qimage.bytesPerLine())
+    return rows[:, :qimage.width()].copy()
+
+
+def render_thumbnail(record, window, thumb_size):
+    """Window one slice and scale it to fit a thumb_size square, as the viewer tiles do"""
+    image_data = record.read_image()
+    if image_data is None:
+        return None
+    image_data = apply_window(image_data, record.transform, window)
+    qimage = QImage(image_data.data, image_data.shape[1], image_data.shape[0],
+                    image_data.shape[1], QImage.Format_Grayscale8)
+    return qimage_to_array(qimage.scaled(thumb_size, thumb_size, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+
+
+def save_gray_png(image_data, file_path):
+    qimage = QImage(image_data.data, image_data.shape[1], image_data.shape[0],
+                    image_data.shape[1], QImage.Format_Grayscale8)
+    if not qimage.save(file_path, 'PNG'):
+        raise IOError(f"Could not write {file_path}")
+
+
+def scan_dicom_tree(root_path, max_workers=None, chunk_size=64):
+    """Header-only scan of every DICOM file under root_path on a process pool"""
+    file_paths = [os.path.join(root_path, relative_path) for relative_path in iter_dicom_files(root_path)]
+    records = []
+    with process_pool(max_workers) as pool:
+        chunks = [file_paths[start:start + chunk_size] for start in range(0, len(file_paths), chunk_size)]
+        for chunk_records, _, errors, timings in pool.map(load_dicom_records, chunks):
+            PERF.merge(timings)
+            records.extend(chunk_records)
+            for error in errors:
+                print(error)
+    return records
+
+
+def export_contact_sheets(input_dir, output_dir, rows=4, cols=4, thumb_size=256, max_workers=None,
+                          save_thumbnails=False):
+    """Render every series under input_dir to rows x cols mosaic PNGs without opening a window
+
+    Slices are decoded one page at a time on a thread pool, so at most one page of decoded
+    slices is held in memory at once.
+    """
+    series_index = DicomSeriesIndex()
+    series_index.add(scan_dicom_tree(input_dir, max_workers))
+    os.makedirs(output_dir, exist_ok=True)
+    page_size = rows * cols
+    sheets_written = 0
+    used_names = set()
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        for study_uid, series_uid in series_index.series_keys():
+            instances = [record for record in series_index.series(study_uid, series_uid) if record.has_pixels]
+            if not instances:
+                continue
+            window = series_default_window(instances)
+            first = instances[0]
+            # Series numbers and descriptions repeat across studies, so names start with a short study hash
+            study_hash = hashlib.sha1(study_uid.encode()).hexdigest()[:8]
+            name = f"{study_hash}_{first.series_number:03d}_{first.modality}_{first.series_description or series_uid}"
+            name = ''.join(char if char.isalnum() or char in '-_.' else '_' for char in name)
+            unique_name, counter = name, 2
+            while unique_name in used_names:
+                unique_name = f"{name}_{counter}"
+                counter += 1
+            name = unique_name
+            used_names.add(name)
+            if save_thumbnails:
+                os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+
+            for page_start in range(0, len(instances), page_size):
+                page = instances[page_start:page_start + page_size]
+                thumbnails = list(pool.map(lambda record: render_thumbnail(record, window, thumb_size), page))
+
+                sheet = np.zeros((rows * thumb_size, cols * thumb_size), dtype=np.uint8)
+                for i, thumbnail in enumerate(thumbnails):
+                    if thumbnail is None:
+                        continue
+                    # Center each thumbnail in its cell
+                    top = (i // cols) * thumb_size + (thumb_size - thumbnail.shape[0]) // 2
+                    left = (i % cols) * thumb_size + (thumb_size - thumbnail.shape[1]) // 2
+                    sheet[top:top + thumbnail.shape[0], left:left + thumbnail.shape[1]] = thumbnail
+                    if save_thumbnails:
+                        save_gray_png(thumbnail, os.path.join(output_dir, name, f"{page_start + i:05d}.png"))
+                save_gray_png(sheet, os.path.join(output_dir, f"{name}_page{page_start // page_size + 1:03d}.png"))
+                sheets_written += 1
+
+    print(f"Wrote {sheets_written} contact sheets in {time.perf_counter() - start_time:.1f} s")
+    return sheets_written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DICOM Viewer. Run without a command to open the viewer.")
+    parser.add_argument('--perf-log', help="Append per-stage timings as JSON lines to this file")
+    commands = parser.add_subparsers(dest='command')
+
+    anonymize_parser = commands.add_parser('anonymize', help="Anonymize a directory tree without opening a window")
+    anonymize_parser.add_argument('input_dir')
+    anonymize_parser.add_argument('output_dir')
+    anonymize_parser.add_argument('--prefix', default='ANON')
+    anonymize_parser.add_argument('--secret', default=os.environ.get('DICOM_ANON_SECRET', ''),
+                                  help="Key for deterministic pseudonyms (default: $DICOM_ANON_SECRET); required")
+    anonymize_parser.add_argument('--workers', type=int, default=None)
+
+    search_parser = commands.add_parser('search', help="Search the catalog of scanned files")
+    search_parser.add_argument('query', help="Free text, or Keyword=value such as Modality=CT")
+    search_parser.add_argument('--limit', type=int, default=200)
+
+    sheet_parser = commands.add_parser('contact-sheet', help="Render series to thumbnail mosaics without a window")
+    sheet_parser.add_argument('input_dir')
+    sheet_parser.add_argument('output_dir')
+    sheet_parser.add_argument('--grid', default='4x4', help="Mosaic layout as ROWSxCOLS")
+    sheet_parser.add_argument('--thumb-size', type=int, default=256)
+    sheet_parser.add_argument('--thumbnails', action='store_true', help="Also save each thumbnail")
+    sheet_parser.add_argument('--workers', type=int, default=None)
+
+    send_parser = commands.add_parser('send', help="Send a folder to a DICOMweb (STOW-RS) endpoint")
+    send_parser.add_argument('input_dir')
+    send_parser.add_argument('--url', default='http://127.0.0.1:8042/studies')
+
+    args = parser.parse_args(argv)
+    if args.perf_log:
+        PERF.log_path = args.perf_log
+        os.environ['DICOM_VIEWER_PERF_LOG'] = args.perf_log  # Worker processes log to the same file
+    if args.command == 'contact-sheet':
+        rows, cols = (int(value) for value in args.grid.lower().split('x'))
+        export_contact_sheets(args.input_dir, args.output_dir, rows, cols, args.thumb_size, args.workers,
+                              args.thumbnails)
+        return 0
+    if args.command == 'search':
+        for match in DicomCatalog().search(args.query, args.limit):
+            print('\t'.join(match[column] for column in ['path', 'patient_id', 'modality', 'study_date',
+                                                          'series_description']))
+        return 0
+    if args.command == 'send':
+        return 0 if send_dicom_files(args.input_dir, args.url) else 1
+    if args.command == 'anonymize':
+        if not args.secret:
+            print("A secret key is required: pass --secret or set DICOM_ANON_SECRET, for example to the output of\n"
+                  "  python -c \"import secrets; print(secrets.token_hex(32))\"\n"
+                  "Keep it private, and reuse it so later runs give the same pseudonyms.", file=sys.stderr)
+            return 2
+        counts = anonymize_tree(args.input_dir, args.output_dir, args.prefix, args.secret, args.workers)
+        return 1 if counts['error'] else 0
+
     app = QApplication([])
     viewer = DICOMViewer()
     viewer.show()
-    app.exec_()
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,622 @@
+import os
 import sys
 import cv2
+import csv
+import json
+import time
+import hashlib
+import argparse
+import threading
 import numpy as np
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QLabel, QPushButton,
                              QVBoxLayout, QHBoxLayout, QFileDialog, QComboBox, QSlider,
-                             QGroupBox, QMessageBox)
-from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtCore import Qt
-import matplotlib.pyplot as plt
+                             QGroupBox, QMessageBox, QSizePolicy)
+from PyQt5.QtGui import QImage, QPixmap, QKeySequence
+from PyQt5.QtCore import Qt, QObject, QTimer, pyqtSignal
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+
+
+INTERPOLATION_METHODS = {
+    "Nearest Neighbor": cv2.INTER_NEAREST,
+    "Linear": cv2.INTER_LINEAR,
+    "Bilinear": cv2.INTER_LINEAR,  # OpenCV's bilinear is same as linear
+    "Cubic": cv2.INTER_CUBIC
+}
+
+
+class NoiseGenerator:
+    """Seeded noise models for uint8 images, computed in float32 and saturated back to 0-255
+
+    Every model can write into a preallocated output (including the input itself), and the float32
+    scratch buffers are kept between calls, so generating many images allocates almost nothing.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = np.random.Generator(np.random.PCG64(seed))
+        self._buffers = {}
+
+    def reseed(self, seed):
+        self.rng = np.random.Generator(np.random.PCG64(seed))
+
+    def scratch(self, name, shape):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[name] = np.empty(shape, dtype=np.float32)
+        return buffer
+
+    @staticmethod
+    def store(values, image, out):
+        """Round and saturate float32 values into out (a new array when out is None)"""
+        if out is None:
+            out = np.empty_like(image)
+        np.rint(values, out=values)
+        np.clip(values, 0, 255, out=values)
+        np.copyto(out, values, casting='unsafe')
+        return out
+
+    def gaussian(self, image, sigma=25.0, out=None):
+        values = self.scratch('values', image.shape)
+        self.rng.standard_normal(dtype=np.float32, out=values)
+        values *= sigma
+        values += image
+        return self.store(values, image, out)
+
+    def salt_and_pepper(self, image, amount=0.05, out=None):
+        draws = self.scratch('pixels', image.shape[:2])
+        self.rng.random(dtype=np.float32, out=draws)
+        if out is None:
+            out = image.copy()
+        elif out is not image:
+            np.copyto(out, image)
+        out[draws < amount] = 0
+        out[draws > 1 - amount] = 255
+        return out
+
+    def speckle(self, image, sigma=1.0, out=None):
+        """Multiplicative noise, one draw per pixel shared by all channels"""
+        field = self.scratch('pixels', image.shape[:2])
+        self.rng.standard_normal(dtype=np.float32, out=field)
+        field *= sigma
+        field += 1.0
+        values = self.scratch('values', image.shape)
+        np.multiply(image, field[..., np.newaxis] if image.ndim == 3 else field, out=values)
+        return self.store(values, image, out)
+
+    def poisson(self, image, peak=64.0, out=None, rows_per_block=256):
+        """Shot noise: intensities scaled to at most `peak` expected photon counts"""
+        if out is None:
+            out = np.empty_like(image)
+        # Generator.poisson has no out argument, so bound its int64 temporaries by working in row blocks
+        for top in range(0, image.shape[0], rows_per_block):
+            block = image[top:top + rows_per_block]
+            values = self.scratch('block', block.shape)
+            np.multiply(block, peak / 255.0, out=values)
+            np.multiply(self.rng.poisson(values), 255.0 / peak, out=values, casting='unsafe')
+            self.store(values, block, out[top:top + rows_per_block])
+        return out
+
+    def rician(self, image, sigma=15.0, out=None):
+        """Magnitude of a complex signal with Gaussian noise in both channels, as in MR magnitude images"""
+        real = self.scratch('values', image.shape)
+        imaginary = self.scratch('imaginary', image.shape)
+        self.rng.standard_normal(dtype=np.float32, out=real)
+        self.rng.standard_normal(dtype=np.float32, out=imaginary)
+        real *= sigma
+        real += image
+        imaginary *= sigma
+        np.hypot(real, imaginary, out=real)
+        return self.store(real, image, out)
+
+
+NOISE_MODELS = {
+    "Gaussian Noise": NoiseGenerator.gaussian,
+    "Salt & Pepper": NoiseGenerator.salt_and_pepper,
+    "Speckle Noise": NoiseGenerator.speckle,
+    "Poisson Noise": NoiseGenerator.poisson,
+    "Rician Noise": NoiseGenerator.rician,
+}
+# One generator per thread, so its scratch buffers are reused across images
+_noise_generators = threading.local()
+
+
+# Lookup tables of the point operations, also used to update histograms without rescanning images
+def gamma_table(gamma):
+    return np.array([((i / 255.0) ** gamma) * 255 for i in np.arange(0, 256)]).astype(np.uint8)
+
+
+def brightness_contrast_table(brightness=0, contrast=0):
+    """Lookup table of brightness_contrast, built by running cv2.convertScaleAbs over every value
+
+    OpenCV computes alpha * value + beta in float32, so a float64 formula differs by one for some
+    slider positions; running the operation itself on the 256 values matches it exactly.
+    """
+    return brightness_contrast(np.arange(256, dtype=np.uint8).reshape(1, 256), brightness, contrast).ravel()
+
+
+def equalize_table(histogram):
+    """Lookup table cv2.equalizeHist builds from a channel histogram"""
+    histogram = np.asarray(histogram, dtype=np.int64)
+    lut = np.zeros(256, dtype=np.uint8)
+    nonzero = np.flatnonzero(histogram)
+    if len(nonzero) == 0:
+        return lut
+    first = nonzero[0]
+    total = int(histogram.sum())
+    if histogram[first] == total:
+        lut[:] = first  # Single-valued channel: equalizeHist fills it with that value
+        return lut
+    scale = np.float32(255.0) / np.float32(total - histogram[first])
+    cumulative = np.cumsum(histogram[first + 1:]).astype(np.float32)
+    lut[first + 1:] = np.clip(np.rint(cumulative * scale), 0, 255)
+    return lut
+
+
+# Image operations: each takes a BGR uint8 image plus its parameters and returns a new image
+def add_noise(image, noise_type, seed=0, **params):
+    generator = getattr(_noise_generators, 'generator', None)
+    if generator is None:
+        generator = _noise_generators.generator = NoiseGenerator()
+    generator.reseed(seed)
+    return NOISE_MODELS[noise_type](generator, image, **params)
+
+
+def denoise(image, filter_type):
+    if filter_type == "Gaussian Filter":
+        return cv2.GaussianBlur(image, (5, 5), 0)
+    if filter_type == "Median Filter":
+        return cv2.medianBlur(image, 5)
+    return cv2.bilateralFilter(image, 9, 75, 75)
+
+
+def enhance_contrast(image, method, gamma=1.5):
+    if method == "Histogram Equalization":
+        return cv2.merge([cv2.equalizeHist(channel) for channel in cv2.split(image)])
+    if method == "CLAHE":
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        return cv2.merge([clahe.apply(channel) for channel in cv2.split(image)])
+    return cv2.LUT(image, gamma_table(gamma))
+
+
+def resize(image, scale, interpolation="Linear"):
+    height, width = image.shape[:2]
+    return cv2.resize(image, (int(width * scale), int(height * scale)),
+                      interpolation=INTERPOLATION_METHODS.get(interpolation, cv2.INTER_LINEAR))
+
+
+def brightness_contrast(image, brightness=0, contrast=0):
+    return cv2.convertScaleAbs(image, alpha=1 + contrast / 100, beta=brightness)
+
+
+def frequency_filter(image, filter_type):
+    """Gaussian lowpass or Laplacian highpass on the grayscale image, returned as BGR"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if filter_type == "lowpass":
+        result = cv2.GaussianBlur(gray, (5, 5), 0)
+    else:
+        result = np.uint8(np.clip(np.absolute(cv2.Laplacian(gray, cv2.CV_64F, ksize=3)), 0, 255))
+    return cv2.cvtColor(result, cv2.COLOR_GRAY2BGR)
+
+
+# Slider previews are redrawn at most once per display frame while dragging
+PREVIEW_INTERVAL_MS = 16
+# Repeated edits of one node (keyboard slider steps) this close together share an undo step
+MERGE_WINDOW_SECONDS = 1.0
+
+OPERATIONS = {
+    'noise': add_noise,
+    'denoise': denoise,
+    'contrast': enhance_contrast,
+    'resize': resize,
+    'brightness_contrast': brightness_contrast,
+    'filter': frequency_filter,
+}
+
+PipelineNode = namedtuple('PipelineNode', ['operation', 'params', 'source'])
+# Graph and input as they were when a background render was requested
+PipelineSnapshot = namedtuple('PipelineSnapshot', ['nodes', 'source_image', 'source_key'])
+
+
+class ResultCache:
+    """LRU cache of node results bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()  # Filled from the worker threads
+
+    def get(self, key):
+        with self._lock:
+            image = self.entries.get(key)
+            if image is not None:
+                self.entries.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        with self._lock:
+            if key in self.entries or image.nbytes > self.max_bytes:
+                return
+            self.entries[key] = image
+            self.current_bytes += image.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+
+class ImagePipeline:
+    """Graph of operations from the loaded image ('input') to the output nodes
+
+    A node's result is cached under a hash of its operation, parameters and source key, so editing
+    one node re-runs only the nodes downstream of it, and undo/redo just swaps the node table.
+    """
+
+    def __init__(self, cache_bytes=512 * 1024 * 1024):
+        self.nodes = {}  # node id -> PipelineNode
+        self.source_image = None
+        self.source_key = None
+        self.cache = ResultCache(cache_bytes)
+        self.undo_stack = []
+        self.redo_stack = []
+        self.last_edit = None
+        self.node_counter = 0
+
+    def set_source(self, image):
+        self.source_image = image
+        self.source_key = hashlib.sha1(image.tobytes()).hexdigest() if image is not None else None
+
+    def set_node(self, node_id, operation, params, source, merge=False):
+        """Point node_id at operation(source)
+
+        With merge, an edit of the same node and operation within MERGE_WINDOW_SECONDS of the last one
+        (and with no end_merge in between) replaces it instead of adding an undo step.
+        """
+        now = time.monotonic()
+        merging = merge and self.last_edit is not None and self.last_edit[:2] == (node_id, operation) and \
+            now - self.last_edit[2] < MERGE_WINDOW_SECONDS
+        if not merging:
+            self.undo_stack.append(dict(self.nodes))
+            self.redo_stack.clear()
+        nodes = dict(self.nodes)
+        if source == node_id and node_id in nodes:
+            # Operating on a node's own result: keep the old node under a new id and chain after it
+            self.node_counter += 1
+            source = f"{node_id}.{self.node_counter}"
+            nodes[source] = nodes[node_id]
+        nodes[node_id] = PipelineNode(operation, dict(params), source)
+        self.nodes = nodes
+        self.last_edit = (node_id, operation, now)
+
+    def end_merge(self):
+        """Make the next edit a new undo step, e.g. when a slider drag ends"""
+        self.last_edit = None
+
+    def undo(self):
+        if not self.undo_stack:
+            return False
+        self.redo_stack.append(self.nodes)
+        self.nodes = self.undo_stack.pop()
+        self.last_edit = None
+        return True
+
+    def redo(self):
+        if not self.redo_stack:
+            return False
+        self.undo_stack.append(self.nodes)
+        self.nodes = self.redo_stack.pop()
+        self.last_edit = None
+        return True
+
+    def snapshot(self):
+        # set_node and undo replace the node table rather than edit it, so it can be shared as is
+        return PipelineSnapshot(self.nodes, self.source_image, self.source_key)
+
+    def has_node(self, node_id):
+        return self.source_image is not None if node_id == 'input' else node_id in self.nodes
+
+    def node_key(self, node_id, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        if node_id == 'input':
+            return snapshot.source_key
+        node = snapshot.nodes[node_id]
+        description = json.dumps([node.operation, node.params, self.node_key(node.source, snapshot)],
+                                 sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def evaluate(self, node_id, snapshot=None):
+        """Result of a node, running only the operations whose results are not cached"""
+        snapshot = snapshot or self.snapshot()
+        if node_id == 'input':
+            return snapshot.source_image
+        if node_id not in snapshot.nodes or snapshot.source_image is None:
+            return None
+        key = self.node_key(node_id, snapshot)
+        result = self.cache.get(key)
+        if result is None:
+            node = snapshot.nodes[node_id]
+            result = OPERATIONS[node.operation](self.evaluate(node.source, snapshot), **node.params)
+            self.cache.put(key, result)
+        return result
+
+    def chain(self, node_id):
+        """Nodes from the input to node_id, in the order they run"""
+        steps = []
+        while node_id != 'input':
+            node = self.nodes[node_id]
+            steps.append(node)
+            node_id = node.source
+        return steps[::-1]
+
+    def to_recipe(self):
+        return {'nodes': {node_id: {'operation': node.operation, 'params': node.params, 'source': node.source}
+                          for node_id, node in self.nodes.items()}}
+
+    def load_recipe(self, recipe):
+        """Replace the graph with a saved recipe as one undoable step"""
+        self.undo_stack.append(dict(self.nodes))
+        self.redo_stack.clear()
+        self.nodes = {node_id: PipelineNode(node['operation'], node['params'], node['source'])
+                      for node_id, node in recipe['nodes'].items()}
+        self.last_edit = None
+
+
+Histograms = namedtuple('Histograms', ['channels', 'gray', 'is_gray'])
+
+
+def compute_histograms(image):
+    """Per-channel and gray 256-bin histograms of a BGR image"""
+    channels = np.stack([cv2.calcHist([image], [channel], None, [256], [0, 256]).ravel()
+                         for channel in range(image.shape[2])])
+    is_gray = all(np.array_equal(image[:, :, 0], image[:, :, channel]) for channel in range(1, image.shape[2]))
+    if is_gray:
+        gray = channels[0]  # BGR2GRAY weights sum to one, so equal channels convert exactly
+    else:
+        gray = cv2.calcHist([cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)], [0], None, [256], [0, 256]).ravel()
+    return Histograms(channels, gray, is_gray)
+
+
+def is_point_operation(operation, params):
+    """True when the operation maps each value through a lookup table"""
+    return operation == 'brightness_contrast' or \
+        (operation == 'contrast' and params.get('method') in ("Gamma Correction", "Histogram Equalization"))
+
+
+def operation_tables(operation, params, source_histograms):
+    """Per-channel lookup tables equivalent to a point operation applied to the source"""
+    if operation == 'brightness_contrast':
+        return [brightness_contrast_table(**params)] * len(source_histograms.channels)
+    if params.get('method') == "Gamma Correction":
+        return [gamma_table(params.get('gamma', 1.5))] * len(source_histograms.channels)
+    return [equalize_table(histogram) for histogram in source_histograms.channels]
+
+
+class HistogramCache:
+    """Histograms of each image version (pipeline node key), computed once
+
+    A point operation's histogram is derived from its source's histogram by pushing the bins
+    through the operation's lookup table, without reading the image again.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pipeline, node_id, snapshot=None):
+        snapshot = snapshot or pipeline.snapshot()
+        if not (node_id == 'input' or node_id in snapshot.nodes) or snapshot.source_image is None:
+            return None
+        key = pipeline.node_key(node_id, snapshot)
+        with self._lock:
+            histograms = self.entries.get(key)
+            if histograms is not None:
+                self.entries.move_to_end(key)
+                return histograms
+
+        node = snapshot.nodes.get(node_id)
+        if node is not None and is_point_operation(node.operation, node.params):
+            source = self.get(pipeline, node.source, snapshot)
+            tables = operation_tables(node.operation, node.params, source)
+            channels = np.stack([np.bincount(table, weights=histogram, minlength=256)
+                                 for table, histogram in zip(tables, source.channels)])
+            is_gray = source.is_gray and all(np.array_equal(table, tables[0]) for table in tables)
+            if is_gray:
+                histograms = Histograms(channels, channels[0], True)
+            else:
+                gray_image = cv2.cvtColor(pipeline.evaluate(node_id, snapshot), cv2.COLOR_BGR2GRAY)
+                histograms = Histograms(channels, cv2.calcHist([gray_image], [0], None, [256], [0, 256]).ravel(),
+                                        False)
+        else:
+            histograms = compute_histograms(pipeline.evaluate(node_id, snapshot))
+
+        with self._lock:
+            self.entries[key] = histograms
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return histograms
+
+
+class RoiStatistics:
+    """Mean and standard deviation of any rectangle of a grayscale image in O(1)
+
+    The sum and squared-sum integral images are built once; each rectangle then needs four lookups
+    in each, however large it is.
+    """
+
+    def __init__(self, gray_image):
+        self.shape = gray_image.shape[:2]
+        self.sums, self.squares = cv2.integral2(gray_image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+    def measure(self, rois):
+        """(means, stds) for an (n, 4) array of x, y, width, height rectangles, clipped to the image"""
+        rois = np.asarray(rois, dtype=np.int64).reshape(-1, 4)
+        height, width = self.shape
+        x0 = np.clip(rois[:, 0], 0, width)
+        y0 = np.clip(rois[:, 1], 0, height)
+        x1 = np.clip(rois[:, 0] + rois[:, 2], 0, width)
+        y1 = np.clip(rois[:, 1] + rois[:, 3], 0, height)
+        area = ((x1 - x0) * (y1 - y0)).astype(np.float64)
+
+        def box_sum(table):
+            return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = box_sum(self.sums) / area
+            variances = box_sum(self.squares) / area - means ** 2
+        # Population std, as np.std; rounding can leave tiny negative variances
+        return means, np.sqrt(np.maximum(variances, 0))
+
+    def mean_std(self, x, y, width, height):
+        means, stds = self.measure([(x, y, width, height)])
+        return float(means[0]), float(stds[0])
+
+
+def snr_cnr(signal_mean, background_mean, background_std):
+    if background_std > 0:
+        return signal_mean / background_std, abs(signal_mean - background_mean) / background_std
+    return float('inf'), float('inf')
+
+
+class ImagePyramid:
+    """Mipmaps of a BGR image, built once per image version; level n is about 2**n times smaller
+
+    A view at any zoom reads only the level just above screen resolution, and only the part of it
+    that is visible, so drawing costs the same for a thumbnail and a 40 megapixel image.
+    """
+
+    def __init__(self, image, min_size=64):
+        self.levels = [image]  # Level 0 is the pipeline result itself, not a copy
+        while min(self.levels[-1].shape[:2]) > 2 * min_size:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels[1:])
+
+    def render(self, view_width, view_height, scale, center_x, center_y, interpolation=cv2.INTER_LINEAR):
+        """BGR view of the image around (center_x, center_y), at scale screen pixels per image pixel"""
+        level_index = 0
+        while level_index + 1 < len(self.levels) and scale * 2 ** (level_index + 1) <= 1.0:
+            level_index += 1
+        level = self.levels[level_index]
+        factor_x = self.shape[1] / level.shape[1]
+        factor_y = self.shape[0] / level.shape[0]
+        # Inverse map from view pixel centers to level pixel centers
+        matrix = np.float32([
+            [1 / (scale * factor_x), 0, ((0.5 - view_width / 2) / scale + center_x) / factor_x - 0.5],
+            [0, 1 / (scale * factor_y), ((0.5 - view_height / 2) / scale + center_y) / factor_y - 0.5]])
+        if scale * factor_x <= 1.0:
+            interpolation = cv2.INTER_LINEAR  # At most 2x minification within a level
+        return cv2.warpAffine(level, matrix, (view_width, view_height),
+                              flags=interpolation | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_CONSTANT)
+
+
+class PyramidViewport(QLabel):
+    """Label drawing an ImagePyramid at a zoom relative to fit-to-window; the wheel zooms, dragging pans"""
+
+    def __init__(self):
+        super().__init__()
+        self.pyramid = None
+        self.zoom = 1.0
+        self.center = (0.5, 0.5)  # View center as a fraction of the image size
+        self.interpolation = cv2.INTER_LINEAR
+        self.drag_position = None
+        self.setMinimumSize(300, 300)
+        # The pixmap always matches the label, so it must not drive the layout
+        self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.setAlignment(Qt.AlignCenter)
+
+    def set_pyramid(self, pyramid):
+        self.pyramid = pyramid
+        if pyramid is None:
+            self.clear()
+        else:
+            self.refresh()
+
+    def reset_view(self):
+        self.zoom = 1.0
+        self.center = (0.5, 0.5)
+
+    def set_view(self, zoom, interpolation):
+        self.zoom = zoom
+        self.interpolation = interpolation
+        self.refresh()
+
+    def scale(self, pyramid):
+        height, width = pyramid.shape[:2]
+        return min(self.width() / width, self.height() / height) * self.zoom
+
+    def render(self, pyramid=None):
+        """BGR image of what this viewport shows, drawn from its own or another pyramid"""
+        pyramid = pyramid or self.pyramid
+        if pyramid is None:
+            return None
+        height, width = pyramid.shape[:2]
+        return pyramid.render(self.width(), self.height(), self.scale(pyramid),
+                              self.center[0] * width, self.center[1] * height, self.interpolation)
+
+    def refresh(self, view=None):
+        view = self.render() if view is None else view
+        if view is None:
+            return
+        rgb = cv2.cvtColor(view, cv2.COLOR_BGR2RGB)
+        q_image = QImage(rgb.data, rgb.shape[1], rgb.shape[0], rgb.strides[0], QImage.Format_RGB888)
+        self.setPixmap(QPixmap.fromImage(q_image))
+
+    def move_center(self, dx, dy, scale):
+        """Shift the view center by (dx, dy) screen pixels, keeping the center on the image"""
+        height, width = self.pyramid.shape[:2]
+        self.center = (min(max(self.center[0] + dx / scale / width, 0.0), 1.0),
+                       min(max(self.center[1] + dy / scale / height, 0.0), 1.0))
+
+    def wheelEvent(self, event):
+        if self.pyramid is None:
+            return
+        # Zoom about the cursor: the image point under it stays put
+        offset_x = event.pos().x() - self.width() / 2
+        offset_y = event.pos().y() - self.height() / 2
+        old_scale = self.scale(self.pyramid)
+        self.zoom = min(max(self.zoom * 1.25 ** (event.angleDelta().y() / 120), 0.1), 64.0)
+        new_scale = self.scale(self.pyramid)
+        self.move_center(offset_x, offset_y, old_scale)
+        self.move_center(-offset_x, -offset_y, new_scale)
+        self.refresh()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.drag_position = event.pos()
+
+    def mouseMoveEvent(self, event):
+        if self.drag_position is None or self.pyramid is None:
+            return
+        delta = event.pos() - self.drag_position
+        self.drag_position = event.pos()
+        self.move_center(-delta.x(), -delta.y(), self.scale(self.pyramid))
+        self.refresh()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_position = None
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.refresh()
+
+
+class RenderSignals(QObject):
+    """Carries background render results back to the GUI thread"""
+    finished = pyqtSignal(int, object)  # generation, {node id: (BGR image, ImagePyramid)}
+    failed = pyqtSignal(int, str)
 
 
 class ImageViewer(QMainWindow):
@@ -20,6 +630,25 @@ class ImageViewer(QMainWindow):
         self.output1_image = None
         self.output2_image = None
         self.current_viewport = 1  # 1 for output1, 2 for output2
+        # Output viewports are nodes of the pipeline; their images are read back from it
+        self.pipeline = ImagePipeline()
+        self.histograms = HistogramCache()
+        self.histogram_canvases = {}  # viewport node id -> embedded canvas, updated while shown
+        # Display pyramids of each image version (pipeline node key), reused by the slider preview
+        self.pyramids = ResultCache(256 * 1024 * 1024)
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.timeout.connect(self.render_brightness_preview)
+
+        # Pipeline renders run off the GUI thread (OpenCV releases the GIL and is multithreaded itself).
+        # One worker means at most one render runs: edits made meanwhile queue, and queued renders that
+        # a newer edit supersedes are cancelled before they start
+        self.render_pool = ThreadPoolExecutor(max_workers=1)
+        self.render_futures = []
+        self.render_generation = 0
+        self.render_signals = RenderSignals()
+        self.render_signals.finished.connect(self.show_outputs)
+        self.render_signals.failed.connect(self.show_render_error)
 
         self.init_ui()
 
@@ -43,40 +672,43 @@ class ImageViewer(QMainWindow):
         # Input viewport
         input_group = QGroupBox("Input Image")
         input_layout = QVBoxLayout()
-        self.input_label = QLabel()
-        self.input_label.setMinimumSize(300, 300)
+        self.input_label = PyramidViewport()
 
         # Add histogram button for input
         self.input_hist_btn = QPushButton("Show Histogram")
-        self.input_hist_btn.clicked.connect(lambda: self.show_histogram(self.input_image))
+        self.input_hist_btn.setCheckable(True)
+        self.input_hist_btn.toggled.connect(lambda shown: self.show_histogram('input', shown))
         input_layout.addWidget(self.input_label)
         input_layout.addWidget(self.input_hist_btn)
+        input_layout.addWidget(self.make_histogram_canvas('input'))
         input_group.setLayout(input_layout)
 
         # Output1 viewport
         output1_group = QGroupBox("Output 1")
         output1_layout = QVBoxLayout()
-        self.output1_label = QLabel()
-        self.output1_label.setMinimumSize(300, 300)
+        self.output1_label = PyramidViewport()
 
         # Add histogram button for output1
         self.output1_hist_btn = QPushButton("Show Histogram")
-        self.output1_hist_btn.clicked.connect(lambda: self.show_histogram(self.output1_image))
+        self.output1_hist_btn.setCheckable(True)
+        self.output1_hist_btn.toggled.connect(lambda shown: self.show_histogram('output1', shown))
         output1_layout.addWidget(self.output1_label)
         output1_layout.addWidget(self.output1_hist_btn)
+        output1_layout.addWidget(self.make_histogram_canvas('output1'))
         output1_group.setLayout(output1_layout)
 
         # Output2 viewport
         output2_group = QGroupBox("Output 2")
         output2_layout = QVBoxLayout()
-        self.output2_label = QLabel()
-        self.output2_label.setMinimumSize(300, 300)
+        self.output2_label = PyramidViewport()
 
         # Add histogram button for output2
         self.output2_hist_btn = QPushButton("Show Histogram")
-        self.output2_hist_btn.clicked.connect(lambda: self.show_histogram(self.output2_image))
+        self.output2_hist_btn.setCheckable(True)
+        self.output2_hist_btn.toggled.connect(lambda shown: self.show_histogram('output2', shown))
         output2_layout.addWidget(self.output2_label)
         output2_layout.addWidget(self.output2_hist_btn)
+        output2_layout.addWidget(self.make_histogram_canvas('output2'))
         output2_group.setLayout(output2_layout)
 
         display_layout.addWidget(input_group)
@@ -104,6 +736,27 @@ class ImageViewer(QMainWindow):
         load_btn.clicked.connect(self.load_image)
         controls_layout.addWidget(load_btn)
 
+        # History and recipe controls
+        history_layout = QHBoxLayout()
+        undo_btn = QPushButton("Undo")
+        undo_btn.setShortcut(QKeySequence.Undo)
+        undo_btn.clicked.connect(self.undo)
+        redo_btn = QPushButton("Redo")
+        redo_btn.setShortcut(QKeySequence.Redo)
+        redo_btn.clicked.connect(self.redo)
+        history_layout.addWidget(undo_btn)
+        history_layout.addWidget(redo_btn)
+        controls_layout.addLayout(history_layout)
+
+        recipe_layout = QHBoxLayout()
+        save_recipe_btn = QPushButton("Save Recipe")
+        save_recipe_btn.clicked.connect(self.save_recipe)
+        load_recipe_btn = QPushButton("Load Recipe")
+        load_recipe_btn.clicked.connect(self.load_recipe)
+        recipe_layout.addWidget(save_recipe_btn)
+        recipe_layout.addWidget(load_recipe_btn)
+        controls_layout.addLayout(recipe_layout)
+
         # Measure SNR/CNR button
         measure_btn = QPushButton("Measure SNR/CNR")
         measure_btn.clicked.connect(self.select_roi)
@@ -115,7 +768,7 @@ class ImageViewer(QMainWindow):
 
         # Noise types
         noise_combo = QComboBox()
-        noise_combo.addItems(["Gaussian Noise", "Salt & Pepper", "Speckle Noise"])
+        noise_combo.addItems(list(NOISE_MODELS))
         noise_btn = QPushButton("Apply Noise")
         noise_btn.clicked.connect(lambda: self.apply_noise(noise_combo.currentText()))
 
@@ -139,15 +792,17 @@ class ImageViewer(QMainWindow):
         cnr_layout = QVBoxLayout()
 
         # Brightness and contrast sliders
-        brightness_slider = QSlider(Qt.Horizontal)
-        brightness_slider.setMinimum(-100)
-        brightness_slider.setMaximum(100)
-        brightness_slider.valueChanged.connect(self.adjust_brightness_contrast)
-
-        contrast_slider = QSlider(Qt.Horizontal)
-        contrast_slider.setMinimum(-100)
-        contrast_slider.setMaximum(100)
-        contrast_slider.valueChanged.connect(self.adjust_brightness_contrast)
+        self.brightness_slider = QSlider(Qt.Horizontal)
+        self.brightness_slider.setMinimum(-100)
+        self.brightness_slider.setMaximum(100)
+        self.brightness_slider.valueChanged.connect(self.adjust_brightness_contrast)
+        self.brightness_slider.sliderReleased.connect(self.release_brightness_contrast)
+
+        self.contrast_slider = QSlider(Qt.Horizontal)
+        self.contrast_slider.setMinimum(-100)
+        self.contrast_slider.setMaximum(100)
+        self.contrast_slider.valueChanged.connect(self.adjust_brightness_contrast)
+        self.contrast_slider.sliderReleased.connect(self.release_brightness_contrast)
 
         # Contrast enhancement methods
         contrast_combo = QComboBox()
@@ -161,9 +816,9 @@ class ImageViewer(QMainWindow):
         filter_btn.clicked.connect(self.apply_highpass_filter)
 
         cnr_layout.addWidget(QLabel("Brightness:"))
-        cnr_layout.addWidget(brightness_slider)
+        cnr_layout.addWidget(self.brightness_slider)
         cnr_layout.addWidget(QLabel("Contrast:"))
-        cnr_layout.addWidget(contrast_slider)
+        cnr_layout.addWidget(self.contrast_slider)
         cnr_layout.addWidget(QLabel("Enhancement Method:"))
         cnr_layout.addWidget(contrast_combo)
         cnr_layout.addWidget(enhance_btn)
@@ -187,103 +842,192 @@ class ImageViewer(QMainWindow):
         if file_name:
             # Load image in BGR format (OpenCV default)
             self.input_image = cv2.imread(file_name)
-            # Convert BGR to RGB for display
-            self.input_image_rgb = cv2.cvtColor(self.input_image, cv2.COLOR_BGR2RGB)
-            self.display_image(self.input_image_rgb, self.input_label)
-
-    def display_image(self, image, label):
-        """Display an image in a QLabel"""
+            if self.input_image is None:
+                QMessageBox.warning(self, "Warning", f"Could not read {file_name}")
+                return
+            # Existing operations are replayed on the new image
+            self.pipeline.set_source(self.input_image)
+            for label in self.viewport_labels().values():
+                label.reset_view()
+            self.input_label.set_pyramid(self.pyramid('input'))
+            self.update_histogram('input')
+            self.refresh_outputs()
+
+    def viewport_labels(self):
+        return {"Input": self.input_label, "Output 1": self.output1_label, "Output 2": self.output2_label}
+
+    def pyramid(self, node_id, snapshot=None):
+        """Display pyramid of a pipeline node, built once per image version"""
+        snapshot = snapshot or self.pipeline.snapshot()
+        image = self.pipeline.evaluate(node_id, snapshot)
         if image is None:
+            return None
+        key = self.pipeline.node_key(node_id, snapshot)
+        pyramid = self.pyramids.get(key)
+        if pyramid is None:
+            pyramid = ImagePyramid(image)
+            self.pyramids.put(key, pyramid)
+        return pyramid
+
+    def make_histogram_canvas(self, node_id):
+        """Embedded histogram plot for one viewport, hidden until its button is checked"""
+        figure = Figure(figsize=(3, 2), tight_layout=True)
+        axes = figure.add_subplot()
+        axes.set_xlim(0, 255)
+        axes.set_xlabel('Pixel Intensity')
+        axes.set_ylabel('Count')
+        bins = np.arange(256)
+        canvas = FigureCanvasQTAgg(figure)
+        canvas.lines = {name: axes.plot(bins, np.zeros(256), color=color, linewidth=1, label=label)[0]
+                        for name, color, label in (('gray', 'black', 'Gray'), (0, 'blue', 'B'),
+                                                   (1, 'green', 'G'), (2, 'red', 'R'))}
+        canvas.setMinimumHeight(180)
+        canvas.setVisible(False)
+        self.histogram_canvases[node_id] = canvas
+        return canvas
+
+    def show_histogram(self, node_id, shown=True):
+        self.histogram_canvases[node_id].setVisible(shown)
+        if shown:
+            self.update_histogram(node_id)
+
+    def update_histogram(self, node_id):
+        """Redraw a shown histogram from the cache; only new image versions are computed"""
+        canvas = self.histogram_canvases[node_id]
+        if not canvas.isVisible():
             return
+        histograms = self.histograms.get(self.pipeline, node_id)
+        axes = canvas.figure.axes[0]
+        if histograms is None:
+            for line in canvas.lines.values():
+                line.set_visible(False)
+        else:
+            canvas.lines['gray'].set_ydata(histograms.gray)
+            canvas.lines['gray'].set_visible(True)
+            for channel in range(3):
+                # Channels of a gray image all match the gray curve
+                canvas.lines[channel].set_visible(not histograms.is_gray)
+                if not histograms.is_gray:
+                    canvas.lines[channel].set_ydata(histograms.channels[channel])
+            axes.legend(handles=[line for line in canvas.lines.values() if line.get_visible()], fontsize='small')
+        axes.relim()
+        axes.autoscale_view(scalex=False)
+        canvas.draw_idle()
 
-        # Convert the image to QImage
-        height, width, channel = image.shape
-        bytes_per_line = 3 * width
-        q_image = QImage(image.data, width, height, bytes_per_line, QImage.Format_RGB888)
-
-        # Convert QImage to QPixmap
-        pixmap = QPixmap.fromImage(q_image)
-        print(f"QPixmap size: {pixmap.size()}")  # Debug statement
+    def change_viewport(self, index):
+        self.current_viewport = index + 1  # Convert to 1-based index
 
-        # Scale the pixmap to fit the label
-        scaled_pixmap = pixmap.scaled(label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    def target_node(self):
+        """Pipeline node written by operations: Output 1 for the Input viewport, otherwise Output 2"""
+        return 'output1' if self.current_viewport == 1 else 'output2'
 
-        # Display the pixmap in the label
-        label.setPixmap(scaled_pixmap)
+    def source_node(self):
+        """Pipeline node read by operations: the input for Output 1, Output 1 for Output 2"""
+        return 'input' if self.current_viewport == 1 else 'output1'
 
-    def show_histogram(self, image):
-        if image is None:
+    def apply_operation(self, operation, params, source=None, merge=False):
+        """Set the target viewport's node to operation(source) and redraw the outputs"""
+        source = source or self.source_node()
+        if not self.pipeline.has_node(source):
             return
-
-        # Convert the image to grayscale
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-        plt.figure(figsize=(8, 6))
-
-        # Plot histogram for the grayscale image
-        hist = cv2.calcHist([gray_image], [0], None, [256], [0, 256])
-        plt.plot(hist, color='black', label='Grayscale Channel')
-
-        plt.title('Grayscale Image Histogram')
-        plt.xlabel('Pixel Intensity')
-        plt.ylabel('Count')
-        plt.legend()
-        plt.show()
-
-    def change_viewport(self, index):
-        self.current_viewport = index + 1  # Convert to 1-based index
-
-    def apply_transformation(self, transformed_image):
-        """Helper method to apply transformation to correct viewport"""
-        if transformed_image is None:
+        self.pipeline.set_node(self.target_node(), operation, params, source, merge)
+        self.refresh_outputs()
+
+    def refresh_outputs(self):
+        """Render both outputs in the background, replacing any render that has not finished yet"""
+        self.render_generation += 1
+        for future in self.render_futures:
+            future.cancel()  # Not started yet; a running render finishes but its result is dropped
+        self.render_futures = [self.render_pool.submit(self.render_outputs, self.render_generation,
+                                                       self.pipeline.snapshot())]
+        self.statusBar().showMessage("Processing...")
+
+    def render_outputs(self, generation, snapshot):
+        """Worker thread: evaluate the output nodes (unchanged ones come from the cache) and build their pyramids"""
+        try:
+            results = {}
+            for node_id in ('output1', 'output2'):
+                if generation != self.render_generation:
+                    return  # Superseded between nodes
+                image = self.pipeline.evaluate(node_id, snapshot)
+                if image is None:
+                    results[node_id] = None
+                    continue
+                results[node_id] = (image, self.pyramid(node_id, snapshot))
+                # Fill the histogram cache here too, so shown histograms redraw without work on the GUI thread
+                self.histograms.get(self.pipeline, node_id, snapshot)
+            self.render_signals.finished.emit(generation, results)
+        except Exception as e:
+            self.render_signals.failed.emit(generation, str(e))
+
+    def show_outputs(self, generation, results):
+        if generation != self.render_generation:
             return
+        for node_id, label in (('output1', self.output1_label), ('output2', self.output2_label)):
+            result = results.get(node_id)
+            setattr(self, f"{node_id}_image", result[0] if result else None)
+            label.set_pyramid(result[1] if result else None)
+            self.update_histogram(node_id)
+        self.statusBar().clearMessage()
+
+    def show_render_error(self, generation, message):
+        if generation == self.render_generation:
+            self.statusBar().showMessage(f"Processing failed: {message}")
+
+    def closeEvent(self, event):
+        self.render_generation += 1
+        self.render_pool.shutdown(wait=False, cancel_futures=True)
+        super().closeEvent(event)
+
+    def undo(self):
+        if self.pipeline.undo():
+            self.refresh_outputs()
+
+    def redo(self):
+        if self.pipeline.redo():
+            self.refresh_outputs()
+
+    def save_recipe(self):
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save Recipe", "", "Recipe Files (*.json)")
+        if file_name:
+            with open(file_name, 'w') as recipe_file:
+                json.dump(self.pipeline.to_recipe(), recipe_file, indent=2)
 
-        # Convert BGR to RGB for display
-        transformed_image_rgb = cv2.cvtColor(transformed_image, cv2.COLOR_BGR2RGB)
-
-        if self.current_viewport == 1:
-            self.output1_image = transformed_image
-            self.display_image(transformed_image_rgb, self.output1_label)
-        else:
-            self.output2_image = transformed_image
-            self.display_image(transformed_image_rgb, self.output2_label)
+    def load_recipe(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "Load Recipe", "", "Recipe Files (*.json)")
+        if file_name:
+            try:
+                with open(file_name) as recipe_file:
+                    self.pipeline.load_recipe(json.load(recipe_file))
+                self.refresh_outputs()
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                QMessageBox.warning(self, "Warning", f"Could not load recipe: {e}")
 
     def apply_zoom(self, factor):
-        """Apply zoom with selected interpolation method"""
-        if self.input_image is None:
+        """Zoom the selected viewport; only the visible region is drawn, from the image pyramid"""
+        self.viewport_labels()[self.viewport_combo.currentText()].set_view(
+            float(factor.replace('x', '')), INTERPOLATION_METHODS[self.interp_combo.currentText()])
+
+    def apply_resize(self):
+        """Add a resize step with the zoom factor and interpolation, so it is saved with the recipe"""
+        self.apply_operation('resize', {'scale': float(self.zoom_combo.currentText().replace('x', '')),
+                                        'interpolation': self.interp_combo.currentText()})
+
+    def export_image(self):
+        """Save the selected viewport's image resized by the zoom factor at full resolution"""
+        image = self.get_current_image()
+        if image is None:
+            QMessageBox.warning(self, "Warning",
+                                f"No image available in {self.viewport_combo.currentText()} viewport!")
             return
-
-        # Get the current interpolation method
-        interp_method = self.interp_combo.currentText()
-
-        # Map interpolation methods to OpenCV constants
-        interpolation_map = {
-            "Nearest Neighbor": cv2.INTER_NEAREST,
-            "Linear": cv2.INTER_LINEAR,
-            "Bilinear": cv2.INTER_LINEAR,  # OpenCV's bilinear is same as linear
-            "Cubic": cv2.INTER_CUBIC
-        }
-
-        # Get interpolation method from map
-        interpolation = interpolation_map.get(interp_method, cv2.INTER_LINEAR)
-
-        # Calculate new dimensions
-        scale = float(factor.replace('x', ''))
-
-        # Get source image based on viewport
-        source_image = self.input_image if self.current_viewport == 1 else self.output1_image
-        if source_image is None:
+        file_name, _ = QFileDialog.getSaveFileName(self, "Export Image", "", "Image Files (*.png *.jpg *.bmp)")
+        if not file_name:
             return
-
-        height, width = source_image.shape[:2]
-        new_height, new_width = int(height * scale), int(width * scale)
-
-        # Apply resize with selected interpolation method
-        resized = cv2.resize(source_image,
-                             (new_width, new_height),
-                             interpolation=interpolation)
-
-        self.apply_transformation(resized)
+        scale = float(self.zoom_combo.currentText().replace('x', ''))
+        if scale != 1.0:
+            image = resize(image, scale, self.interp_combo.currentText())
+        if not cv2.imwrite(file_name, image):
+            QMessageBox.warning(self, "Warning", f"Could not write {file_name}")
 
     def init_resolution_controls(self):
         """Initialize resolution controls"""
@@ -293,6 +1037,7 @@ class ImageViewer(QMainWindow):
         # Zoom controls
         self.zoom_combo = QComboBox()
         self.zoom_combo.addItems(["0.5x", "1x", "2x", "4x"])
+        self.zoom_combo.setCurrentText("1x")
         self.zoom_combo.currentTextChanged.connect(self.apply_zoom)
 
         # Interpolation method
@@ -310,113 +1055,61 @@ class ImageViewer(QMainWindow):
         apply_zoom_btn.clicked.connect(lambda: self.apply_zoom(self.zoom_combo.currentText()))
         resolution_layout.addWidget(apply_zoom_btn)
 
+        # Zooming only changes the view; this records an actual resize in the pipeline
+        resize_btn = QPushButton("Resize Image")
+        resize_btn.clicked.connect(self.apply_resize)
+        resolution_layout.addWidget(resize_btn)
+
+        # Full-resolution resizing happens only here
+        export_btn = QPushButton("Export Image")
+        export_btn.clicked.connect(self.export_image)
+        resolution_layout.addWidget(export_btn)
+
         resolution_group.setLayout(resolution_layout)
         return resolution_group
 
     def apply_noise(self, noise_type):
-        # Get source image based on viewport
-        source_image = self.input_image if self.current_viewport == 1 else self.output1_image
-        if source_image is None:
-            return
-
-        if noise_type == "Gaussian Noise":
-            noise = np.random.normal(0, 25, source_image.shape).astype(np.uint8)
-            noisy = cv2.add(source_image, noise)
-        elif noise_type == "Salt & Pepper":
-            noisy = source_image.copy()
-            prob = 0.05
-            thresh = 1 - prob
-            rnd = np.random.random(source_image.shape[:2])
-            noisy[rnd < prob] = 0
-            noisy[rnd > thresh] = 255
-        else:  # Speckle noise
-            noise = np.random.normal(0, 1, source_image.shape[:2])
-            noise = np.repeat(noise[:, :, np.newaxis], 3, axis=2)
-            noisy = source_image + source_image * noise
-            noisy = np.clip(noisy, 0, 255).astype(np.uint8)
-
-        self.apply_transformation(noisy)
+        # A fresh seed per application, recorded so replaying the recipe gives the same noise
+        self.apply_operation('noise', {'noise_type': noise_type, 'seed': int.from_bytes(os.urandom(4), 'little')})
 
     def apply_denoising(self, filter_type):
-        # Get source image based on viewport
-        source_image = self.input_image if self.current_viewport == 1 else self.output1_image
-        if source_image is None:
-            return
-
-        if filter_type == "Gaussian Filter":
-            filtered = cv2.GaussianBlur(source_image, (5, 5), 0)
-        elif filter_type == "Median Filter":
-            filtered = cv2.medianBlur(source_image, 5)
-        else:  # Bilateral Filter
-            filtered = cv2.bilateralFilter(source_image, 9, 75, 75)
-
-        self.apply_transformation(filtered)
+        self.apply_operation('denoise', {'filter_type': filter_type})
 
     def enhance_contrast(self, method):
-        # Get source image based on viewport
-        source_image = self.input_image if self.current_viewport == 1 else self.output1_image
-        if source_image is None:
-            return
-
-        if method == "Histogram Equalization":
-            channels = cv2.split(source_image)
-            eq_channels = [cv2.equalizeHist(ch) for ch in channels]
-            enhanced = cv2.merge(eq_channels)
-        elif method == "CLAHE":
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            channels = cv2.split(source_image)
-            eq_channels = [clahe.apply(ch) for ch in channels]
-            enhanced = cv2.merge(eq_channels)
-        else:  # Gamma Correction
-            gamma = 1.5
-            lookup_table = np.array([((i / 255.0) ** gamma) * 255 for i in np.arange(0, 256)]).astype(np.uint8)
-            enhanced = cv2.LUT(source_image, lookup_table)
-
-        self.apply_transformation(enhanced)
+        self.apply_operation('contrast', {'method': method})
 
     def adjust_brightness_contrast(self):
-        # Get source image based on viewport
-        source_image = self.input_image if self.current_viewport == 1 else self.output1_image
-        if source_image is None:
+        if self.brightness_slider.isSliderDown() or self.contrast_slider.isSliderDown():
+            # While dragging, only a screen-sized proxy is redrawn, at most once per frame
+            if not self.preview_timer.isActive():
+                self.preview_timer.start(PREVIEW_INTERVAL_MS)
             return
-
-        brightness = self.sender().value() if isinstance(self.sender(), QSlider) else 0
-        contrast = self.sender().value() if isinstance(self.sender(), QSlider) else 0
-
-        adjusted = cv2.convertScaleAbs(source_image,
-                                       alpha=1 + contrast / 100,
-                                       beta=brightness)
-        self.apply_transformation(adjusted)
-
-    def apply_highpass_filter(self):
-        """Apply lowpass or highpass filter to the image"""
-        # Get source image based on viewport
-        source_image = self.get_current_image()
-        if source_image is None:
+        self.commit_brightness_contrast()
+
+    def commit_brightness_contrast(self):
+        """Run the adjustment on the full-resolution image (slider released or moved by keyboard)"""
+        self.preview_timer.stop()
+        self.apply_operation('brightness_contrast', {'brightness': self.brightness_slider.value(),
+                                                     'contrast': self.contrast_slider.value()}, merge=True)
+
+    def release_brightness_contrast(self):
+        """A finished drag is one undo step of its own, so the next drag does not merge into it"""
+        self.commit_brightness_contrast()
+        self.pipeline.end_merge()
+
+    def render_brightness_preview(self):
+        label = self.output1_label if self.target_node() == 'output1' else self.output2_label
+        pyramid = self.pyramid(self.source_node())
+        if pyramid is None:
             return
+        # Only the visible, screen-sized region of the source is adjusted, drawn at the viewport's zoom
+        view = label.render(pyramid)
+        label.refresh(brightness_contrast(view, self.brightness_slider.value(), self.contrast_slider.value()))
 
-        # Convert to grayscale for filtering
-        gray = cv2.cvtColor(source_image, cv2.COLOR_BGR2GRAY)
-
-        # Get filter type (assuming filter_combo is saved as self.filter_combo in init_ui)
-        filter_type = self.filter_combo.currentText()
-
-        if filter_type == "lowpass":
-            # Apply Gaussian blur for lowpass
-            result = cv2.GaussianBlur(gray, (5, 5), 0)
-        else:  # highpass
-            # Apply Laplacian filter for better high-pass filtering
-            kernel_size = 3
-            result = cv2.Laplacian(gray, cv2.CV_64F, ksize=kernel_size)
-            # Convert back to uint8 and normalize
-            result = np.absolute(result)
-            result = np.uint8(np.clip(result, 0, 255))
-
-        # Convert back to BGR for display
-        result = cv2.cvtColor(result, cv2.COLOR_GRAY2BGR)
-
-        # Apply the transformation to the correct viewport
-        self.apply_transformation(result)
+    def apply_highpass_filter(self):
+        """Apply lowpass or highpass filter to the image shown in the selected viewport"""
+        source = {"Input": 'input', "Output 1": 'output1', "Output 2": 'output2'}[self.viewport_combo.currentText()]
+        self.apply_operation('filter', {'filter_type': self.filter_combo.currentText()}, source)
 
     def select_roi(self):
         """Allow user to select ROIs and calculate SNR/CNR measurements for grayscale images"""
@@ -462,23 +1155,13 @@ class ImageViewer(QMainWindow):
         if roi2 == (0, 0, 0, 0):
             return
 
-        # Extract ROIs from grayscale image
-        signal_roi = gray_image[int(roi1[1]):int(roi1[1] + roi1[3]),
-                     int(roi1[0]):int(roi1[0] + roi1[2])]
-        background_roi = gray_image[int(roi2[1]):int(roi2[1] + roi2[3]),
-                         int(roi2[0]):int(roi2[0] + roi2[2])]
-
-        # Calculate signal statistics
-        signal_mean = np.mean(signal_roi)
-        signal_std = np.std(signal_roi)
-
-        # Calculate background statistics
-        background_mean = np.mean(background_roi)
-        background_std = np.std(background_roi)
+        # Calculate signal and background statistics
+        statistics = RoiStatistics(gray_image)
+        signal_mean, signal_std = statistics.mean_std(*roi1)
+        background_mean, background_std = statistics.mean_std(*roi2)
 
         # Calculate SNR and CNR
-        snr = signal_mean / background_std if background_std > 0 else float('inf')
-        cnr = abs(signal_mean - background_mean) / background_std if background_std > 0 else float('inf')
+        snr, cnr = snr_cnr(signal_mean, background_mean, background_std)
 
         # Format results message
         message = f"Measurements for {self.viewport_combo.currentText()}:\n\n"
@@ -494,8 +1177,311 @@ class ImageViewer(QMainWindow):
         QMessageBox.information(self, "SNR and CNR Measurements", message)
 
 
-if __name__ == '__main__':
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def recipe_steps(recipe, node_id=None):
+    """Operations from the input to node_id (default: the last output) of a saved recipe"""
+    pipeline = ImagePipeline()
+    pipeline.load_recipe(recipe)
+    if node_id is None:
+        node_id = 'output2' if 'output2' in pipeline.nodes else 'output1'
+    return [(node.operation, node.params) for node in pipeline.chain(node_id)]
+
+
+def iter_image_files(root_path):
+    """Yield image paths under root_path relative to it, in a stable order"""
+    for directory, subdirectories, filenames in os.walk(root_path):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(directory, filename), root_path)
+
+
+def process_images(jobs, steps):
+    """Worker task: run the recipe steps on (source, destination, relative path) jobs"""
+    cv2.setNumThreads(1)  # One image per process; OpenCV's own threads would oversubscribe the cores
+    results = []
+    for source_path, output_path, relative_path in jobs:
+        try:
+            image = cv2.imread(source_path)
+            if image is None:
+                raise ValueError("not a readable image")
+            for operation, params in steps:
+                if 'seed' in params:
+                    # Different noise per image, but the same noise every time this image is processed
+                    digest = hashlib.sha1(f"{params['seed']}:{relative_path}".encode()).digest()
+                    params = dict(params, seed=int.from_bytes(digest[:4], 'little'))
+                image = OPERATIONS[operation](image, **params)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            if not cv2.imwrite(output_path, image):
+                raise IOError(f"could not write {output_path}")
+            results.append((relative_path, None))
+        except Exception as e:
+            results.append((relative_path, str(e)))
+    return results
+
+
+def run_batch(input_dir, output_dir, steps, max_workers=None, chunk_size=8):
+    """Apply recipe steps to every image under input_dir, mirroring the tree into output_dir"""
+    max_workers = max_workers or os.cpu_count() or 1
+
+    def job_chunks():
+        chunk = []
+        for relative_path in iter_image_files(input_dir):
+            chunk.append((os.path.join(input_dir, relative_path), os.path.join(output_dir, relative_path),
+                          relative_path))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    done = errors = 0
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        # Only a few chunks are in flight, so memory stays bounded however large the directory is
+        chunks = job_chunks()
+        pending = set()
+        while True:
+            while len(pending) < max_workers * 2:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.add(pool.submit(process_images, chunk, steps))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                for relative_path, error in future.result():
+                    done += 1
+                    if error:
+                        errors += 1
+                        print(f"Error processing {relative_path}: {error}")
+            elapsed = time.perf_counter() - start_time
+            print(f"\r{done} images, {done / elapsed:.1f} images/s", end='', flush=True)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\rProcessed {done} images ({errors} errors) in {elapsed:.1f} s, "
+          f"{done / elapsed if elapsed > 0 else 0:.1f} images/s")
+    return done, errors
+
+
+ROI_FILE_COLUMNS = ['name', 'x', 'y', 'width', 'height']
+ROI_TABLE_COLUMNS = ['image', 'roi', 'mean', 'std', 'background', 'snr', 'cnr']
+
+
+def read_roi_file(file_path):
+    """ROIs from a CSV with name, x, y, width, height and an optional background column
+
+    A row whose background names another ROI is also reported as SNR/CNR against that ROI.
+    Raises ValueError naming the file, line and value of the first invalid row.
+    """
+    with open(file_path, newline='') as roi_file:
+        reader = csv.DictReader(roi_file)
+        missing = [column for column in ROI_FILE_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"{file_path}: missing column(s) {', '.join(missing)}")
+        rows = [(reader.line_num, row) for row in reader]
+
+    names, rectangles = [], []
+    for line, row in rows:
+        name = (row['name'] or '').strip()
+        if not name or name in names:
+            raise ValueError(f"{file_path}:{line}: {'duplicate' if name else 'empty'} ROI name {name!r}")
+        rectangle = []
+        for column in ROI_FILE_COLUMNS[1:]:
+            try:
+                rectangle.append(int(row[column]))
+            except (TypeError, ValueError):
+                raise ValueError(f"{file_path}:{line}: {column} {row[column]!r} is not an integer") from None
+        if rectangle[0] < 0 or rectangle[1] < 0 or rectangle[2] <= 0 or rectangle[3] <= 0:
+            raise ValueError(f"{file_path}:{line}: ROI {name!r} has an empty or negative rectangle {rectangle}")
+        names.append(name)
+        rectangles.append(rectangle)
+
+    backgrounds = []
+    for line, row in rows:
+        background = (row.get('background') or '').strip()
+        if background and background not in names:
+            raise ValueError(f"{file_path}:{line}: background {background!r} is not an ROI name")
+        backgrounds.append(names.index(background) if background else -1)
+    return names, np.array(rectangles, dtype=np.int64).reshape(-1, 4), backgrounds
+
+
+def measure_images(jobs, names, rectangles, backgrounds):
+    """Worker task: ROI table rows for each (image path, relative path) job, and the images that failed"""
+    rows, errors = [], []
+    for image_path, relative_path in jobs:
+        image = cv2.imread(image_path)
+        if image is None:
+            errors.append(relative_path)
+            continue
+        means, stds = RoiStatistics(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)).measure(rectangles)
+        for index, name in enumerate(names):
+            row = {'image': relative_path, 'roi': name, 'mean': f"{means[index]:.3f}",
+                   'std': f"{stds[index]:.3f}", 'background': '', 'snr': '', 'cnr': ''}
+            background = backgrounds[index]
+            if background >= 0:
+                snr, cnr = snr_cnr(means[index], means[background], stds[background])
+                row.update(background=names[background], snr=f"{snr:.3f}", cnr=f"{cnr:.3f}")
+            rows.append(row)
+    return rows, errors
+
+
+def run_roi_statistics(input_dir, rois, output, max_workers=None, chunk_size=16):
+    """Write one table row per image and ROI for every image under input_dir; returns the failed image count
+
+    rois is the (names, rectangles, backgrounds) tuple from read_roi_file. The table may go to
+    standard output, so progress and errors are reported on standard error.
+    """
+    names, rectangles, backgrounds = rois
+    max_workers = max_workers or os.cpu_count() or 1
+    paths = ((os.path.join(input_dir, relative_path), relative_path) for relative_path in iter_image_files(input_dir))
+    writer = csv.DictWriter(output, fieldnames=ROI_TABLE_COLUMNS)
+    writer.writeheader()
+    images = failed = 0
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        while True:
+            while len(pending) < max_workers * 2:
+                chunk = [job for _, job in zip(range(chunk_size), paths)]
+                if not chunk:
+                    break
+                pending.add(pool.submit(measure_images, chunk, names, rectangles, backgrounds))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                rows, errors = future.result()
+                writer.writerows(rows)
+                images += len({row['image'] for row in rows})
+                failed += len(errors)
+                for relative_path in errors:
+                    print(f"Error reading {relative_path}", file=sys.stderr)
+    elapsed = time.perf_counter() - start_time
+    print(f"Measured {len(names)} ROIs in {images} images ({failed} errors) in {elapsed:.1f} s", file=sys.stderr)
+    return failed
+
+
+def operation_halo(operation, params):
+    """Pixels of context an operation needs around each output pixel when run tile by tile"""
+    if operation in ('noise', 'brightness_contrast') or \
+            (operation == 'contrast' and params.get('method') == "Gamma Correction"):
+        return 0
+    if operation == 'denoise':
+        return 4 if params.get('filter_type') == "Bilateral Filter" else 2  # d=9 vs 5x5 kernels
+    if operation == 'filter':
+        return 2 if params.get('filter_type') == "lowpass" else 1
+    raise ValueError(f"'{operation}' needs the whole image and cannot run on tiles")
+
+
+def process_tiled(source, output, steps, tile_size=1024, max_workers=None):
+    """Run recipe steps over (height, width, 3) arrays tile by tile, e.g. memory-mapped .npy files
+
+    Each tile is read with a halo wide enough for every neighborhood filter in the chain, so the
+    result matches processing the whole image while only a few tiles are in memory at once.
+    """
+    halo = sum(operation_halo(operation, params) for operation, params in steps)
+    height, width = source.shape[:2]
+
+    def process_tile(top, left):
+        bottom, right = min(top + tile_size, height), min(left + tile_size, width)
+        y0, x0 = max(0, top - halo), max(0, left - halo)
+        tile = np.ascontiguousarray(source[y0:min(height, bottom + halo), x0:min(width, right + halo)])
+        for operation, params in steps:
+            if 'seed' in params:
+                params = dict(params, seed=params['seed'] + top * width + left)  # Independent noise per tile
+            tile = OPERATIONS[operation](tile, **params)
+        output[top:bottom, left:right] = tile[top - y0:bottom - y0, left - x0:right - x0]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    tiles = iter([(top, left) for top in range(0, height, tile_size) for left in range(0, width, tile_size)])
+    start_time = time.perf_counter()
+    # OpenCV releases the GIL, so threads process tiles in parallel without copying them between processes
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        while True:
+            while len(pending) < max_workers * 2:
+                tile = next(tiles, None)
+                if tile is None:
+                    break
+                pending.add(pool.submit(process_tile, *tile))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()
+    if isinstance(output, np.memmap):
+        output.flush()
+    elapsed = time.perf_counter() - start_time
+    print(f"Processed {width}x{height} in {tile_size}px tiles (halo {halo}px) in {elapsed:.1f} s, "
+          f"{width * height / 1e6 / elapsed if elapsed > 0 else 0:.1f} MP/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Image Quality Viewer. Run without a command to open the window.")
+    commands = parser.add_subparsers(dest='command')
+
+    batch_parser = commands.add_parser('batch', help="Apply a saved recipe to every image in a directory")
+    batch_parser.add_argument('input_dir')
+    batch_parser.add_argument('output_dir')
+    batch_parser.add_argument('--recipe', required=True, help="Recipe saved with 'Save Recipe'")
+    batch_parser.add_argument('--node', default=None, help="Recipe node to write (default: the last output)")
+    batch_parser.add_argument('--workers', type=int, default=None)
+
+    tiled_parser = commands.add_parser('tiled', help="Apply a recipe to a memory-mapped .npy image larger than RAM")
+    tiled_parser.add_argument('input', help="(height, width, 3) uint8 BGR array saved with numpy.save")
+    tiled_parser.add_argument('output', help="Output .npy file, written through a memory map")
+    tiled_parser.add_argument('--recipe', required=True, help="Recipe saved with 'Save Recipe'")
+    tiled_parser.add_argument('--node', default=None, help="Recipe node to write (default: the last output)")
+    tiled_parser.add_argument('--tile-size', type=int, default=1024)
+    tiled_parser.add_argument('--workers', type=int, default=None)
+
+    roi_parser = commands.add_parser('roi-stats', help="Measure mean, std, SNR and CNR of ROIs in every image")
+    roi_parser.add_argument('input_dir')
+    roi_parser.add_argument('--rois', required=True, help="CSV with name,x,y,width,height[,background] columns")
+    roi_parser.add_argument('--output', help="CSV file for the table (default: standard output)")
+    roi_parser.add_argument('--workers', type=int, default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == 'roi-stats':
+        # Checked before the output is opened, so a bad ROI file does not truncate an earlier table
+        try:
+            rois = read_roi_file(args.rois)
+        except (OSError, ValueError) as e:
+            print(f"Cannot read ROIs: {e}", file=sys.stderr)
+            return 1
+        if args.output:
+            with open(args.output, 'w', newline='') as output:
+                failed = run_roi_statistics(args.input_dir, rois, output, args.workers)
+        else:
+            failed = run_roi_statistics(args.input_dir, rois, sys.stdout, args.workers)
+        return 1 if failed else 0
+    if args.command == 'tiled':
+        with open(args.recipe) as recipe_file:
+            steps = recipe_steps(json.load(recipe_file), args.node)
+        try:
+            halo = sum(operation_halo(operation, params) for operation, params in steps)
+        except ValueError as e:
+            print(f"Cannot process tiles: {e}")
+            return 1
+        source = np.load(args.input, mmap_mode='r')
+        output = np.lib.format.open_memmap(args.output, mode='w+', dtype=np.uint8, shape=source.shape)
+        process_tiled(source, output, steps, max(args.tile_size, 2 * halo), args.workers)
+        return 0
+    if args.command == 'batch':
+        with open(args.recipe) as recipe_file:
+            steps = recipe_steps(json.load(recipe_file), args.node)
+        _, errors = run_batch(args.input_dir, args.output_dir, steps, args.workers)
+        return 1 if errors else 0
+
     app = QApplication(sys.argv)
     viewer = ImageViewer()
     viewer.show()
-    sys.exit(app.exec_())
+    return app.exec_()
+
+
+if __name__ == '__main__':
+    sys.exit(main())